@@ -0,0 +1,23 @@
+#!/usr/bin/env python
+
+# This file is part of Gansa.
+
+# Gansa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Gansa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Gansa.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+benchmarks for gansa
+
+generate.py writes synthetic projects of any size, and run.py times loading,
+building, querying and serving them. see benchmarks/README.md.
+"""
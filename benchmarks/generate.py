@@ -0,0 +1,396 @@
+#!/usr/bin/env python
+
+# This file is part of Gansa.
+
+# Gansa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Gansa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Gansa.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+generate synthetic gansa projects
+
+usage: python -m benchmarks.generate FOLDER [options]
+"""
+
+from __future__ import print_function
+import os, csv, json, random, sqlite3, datetime, argparse, shutil
+import yaml
+
+ENGINES = ["yaml", "json", "csv", "sqlite", "mongodb"]
+
+AUTHORS = ["ada", "grace", "edsger", "barbara", "donald", "frances", "alan", "margaret", "ken", "radia"]
+
+WORDS = (
+	"lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor "
+	"incididunt ut labore et dolore magna aliqua enim ad minim veniam quis nostrud "
+	"exercitation ullamco laboris nisi aliquip ex ea commodo consequat"
+).split()
+
+# the query used by the index view, for each database engine
+QUERIES = {
+	"yaml": 'sorted([p for p in db["posts"] if p["published"]], key=lambda p: p["date"], reverse=True)',
+	"json": 'sorted([p for p in db["posts"] if p["published"]], key=lambda p: p["date"], reverse=True)',
+	"csv": {
+		"table": "posts",
+		"filter": 'row["published"] == True',
+		"order": "date descending"
+	},
+	"sqlite": {
+		"models": "sqlmodels:Post",
+		"filter": "sqlmodels.Post.published == True",
+		"order": "sqlmodels.Post.date.desc()"
+	},
+	"mongodb": {
+		"model": "mongomodels:Post",
+		"filter": {"published": True},
+		"order": "-date"
+	}
+}
+
+USER_SETTINGS = {
+	"yaml": {"engine": "yaml", "uri": "posts.yaml"},
+	"json": {"engine": "json", "uri": "posts.json"},
+	"csv": {"engine": "csv", "uri": "posts.csv", "store_row_as": "dict"},
+	"sqlite": {"engine": "sqlite", "uri": "sqlite:///posts.db"},
+	"mongodb": {"engine": "mongodb", "uri": "mongodb://localhost/gansa-benchmark"}
+}
+
+SQL_MODELS = """from sqlalchemy import *
+from sqlalchemy.ext.declarative import declarative_base
+
+Base = declarative_base()
+
+class Post(Base):
+	__tablename__ = "posts"
+
+	id = Column(Integer, primary_key=True)
+	slug = Column(String, nullable=False)
+	title = Column(String)
+	author = Column(String)
+	date = Column(String)
+	views = Column(Integer)
+	score = Column(Float)
+	published = Column(Boolean)
+"""
+
+MONGO_MODELS = """from mongoengine import *
+
+class Post(Document):
+	meta = {"collection": "posts"}
+
+	slug = StringField(required=True)
+	title = StringField()
+	author = StringField()
+	date = StringField()
+	views = IntField()
+	score = FloatField()
+	published = BooleanField()
+"""
+
+CALLBACKS = """def page(context, view, site):
+
+	context = dict(context)
+	context["section"] = view["full_route"].split("/")[1:-1]
+
+	return context
+"""
+
+def _write(fname, text):
+
+	folder = os.path.dirname(fname)
+	if folder and not os.path.exists(folder):
+		os.makedirs(folder)
+
+	with open(fname, "w") as f:
+		f.write(text)
+
+def _sentence(rng, length):
+	return " ".join(rng.choice(WORDS) for _ in range(length)).capitalize() + "."
+
+def make_rows(count, seed=0):
+	""" return count rows of fake blog posts """
+
+	rng = random.Random(seed)
+	start = datetime.datetime(2010, 1, 1)
+	rows = []
+
+	for i in range(count):
+		rows.append({
+			"id": i + 1,
+			"slug": "post{0}".format(i),
+			"title": _sentence(rng, 5)[:-1],
+			"author": rng.choice(AUTHORS),
+			"date": (start + datetime.timedelta(hours=rng.randint(0, 24 * 365 * 10))).strftime("%Y-%m-%d %H:%M:%S"),
+			"views": rng.randint(0, 100000),
+			"score": round(rng.random() * 5, 3),
+			"published": rng.random() < 0.8
+		})
+
+	return rows
+
+def _sections(depth, fanout):
+	""" return the route components of every leaf section """
+
+	sections = [[]]
+	for level in range(depth):
+		sections = [s + ["s{0}".format(i)] for s in sections for i in range(fanout)]
+
+	return sections
+
+def _section_views(path, pages):
+	""" return a list of views for the pages below path """
+
+	views = []
+	children = {}
+
+	for section, name in pages:
+		if section[:len(path)] != path:
+			continue
+		if len(section) == len(path):
+			views.append({"route": name})
+		else:
+			children.setdefault(section[len(path)], None)
+
+	for child in sorted(children):
+		views.append({"route": child, "subviews": _section_views(path + [child], pages)})
+
+	return views
+
+def write_templates(src, inheritance):
+
+	folder = os.path.join(src, "templates")
+
+	_write(os.path.join(folder, "layout0.html"), """<!DOCTYPE html>
+<html>
+<head>
+	<title>{% block title %}{{ title }}{% endblock %}</title>
+	<meta http-equiv="Content-Type" content="text/html; charset=utf-8" />
+	<link rel="stylesheet" href="/css/asset0.css" type="text/css" />
+</head>
+<body>
+	<header>{% block header %}<a href="/index.html">home</a>{% endblock %}</header>
+	{% block content %}{% endblock %}
+	<footer>{% block footer %}{{ route }}{% endblock %}</footer>
+</body>
+</html>
+""")
+
+	for level in range(1, inheritance):
+		_write(os.path.join(folder, "layout{0}.html".format(level)), """{{% extends "layout{0}.html" %}}
+{{% block header %}}{{{{ super() }}}} <span class="level{1}">level {1}</span>{{% endblock %}}
+{{% block footer %}}{{% include "partial.html" %}}{{{{ super() }}}}{{% endblock %}}
+""".format(level - 1, level))
+
+	_write(os.path.join(folder, "partial.html"), """<nav>{% for s in section or [] %}<a href="#">{{ s }}</a>{% endfor %}</nav>
+""")
+
+	top = "layout{0}.html".format(max(inheritance, 1) - 1)
+
+	_write(os.path.join(folder, "page.html"), """{{% extends "{0}" %}}
+""".format(top))
+
+	_write(os.path.join(folder, "index.html"), """{{% extends "{0}" %}}
+{{% block title %}}Index{{% endblock %}}
+{{% block content %}}
+<ul>
+{{% for post in query %}}
+	<li><a href="#{{{{ post.slug }}}}">{{{{ post.title }}}}</a> by {{{{ post.author }}}} ({{{{ post.date }}}})</li>
+{{% endfor %}}
+</ul>
+{{% endblock %}}
+""".format(top))
+
+def write_pages(src, pages, paragraphs, seed=0):
+
+	rng = random.Random(seed)
+
+	for section, name in pages:
+		body = ["title: " + _sentence(rng, 4)[:-1], "author: " + rng.choice(AUTHORS), "", "# " + _sentence(rng, 6)[:-1], ""]
+
+		for p in range(paragraphs):
+			body.append(" ".join(_sentence(rng, rng.randint(8, 20)) for _ in range(4)))
+			body.append("")
+			if p % 3 == 1:
+				body.extend("* " + _sentence(rng, 5) for _ in range(4))
+				body.append("")
+			if p % 4 == 2:
+				body.extend(["    for i in range(10):", "        print(i)", ""])
+
+		fname = os.path.join(src, "pages", *(section + [name.rsplit(".", 1)[0] + ".md"]))
+		_write(fname, "\n".join(body))
+
+def write_assets(src, count, size, seed=0):
+
+	rng = random.Random(seed)
+	kinds = ["css", "js", "img"]
+
+	for i in range(count):
+		kind = kinds[i % len(kinds)]
+		fname = os.path.join(src, "assets", kind, "asset{0}.{1}".format(i, {"img": "png"}.get(kind, kind)))
+
+		folder = os.path.dirname(fname)
+		if not os.path.exists(folder):
+			os.makedirs(folder)
+
+		with open(fname, "wb") as f:
+			f.write(bytearray(rng.randint(0, 255) for _ in range(size)))
+
+def write_databases(src, rows):
+	""" write the same rows as a yaml file, a json file, a csv file and a sqlite database """
+
+	with open(os.path.join(src, "posts.yaml"), "w") as f:
+		yaml.safe_dump({"posts": rows}, f, default_flow_style=False)
+
+	with open(os.path.join(src, "posts.json"), "w") as f:
+		json.dump({"posts": rows}, f)
+
+	columns = ["id", "slug", "title", "author", "date", "views", "score", "published"]
+
+	with open(os.path.join(src, "posts.csv"), "w") as f:
+		writer = csv.writer(f, lineterminator="\n")
+		writer.writerow(columns)
+		for row in rows:
+			# the csv engine only reads lowercase booleans
+			writer.writerow([str(row[c]).lower() if isinstance(row[c], bool) else row[c] for c in columns])
+
+	fname = os.path.join(src, "posts.db")
+	if os.path.exists(fname):
+		os.remove(fname)
+
+	connection = sqlite3.connect(fname)
+	connection.execute(
+		"create table posts (id integer primary key, slug varchar not null, title varchar, "
+		"author varchar, date varchar, views integer, score float, published boolean)"
+	)
+	connection.executemany(
+		"insert into posts values (?, ?, ?, ?, ?, ?, ?, ?)",
+		[[row[c] for c in columns] for row in rows]
+	)
+	connection.commit()
+	connection.close()
+
+	_write(os.path.join(src, "sqlmodels.py"), SQL_MODELS)
+	_write(os.path.join(src, "mongomodels.py"), MONGO_MODELS)
+
+	for engine, database in USER_SETTINGS.items():
+		_write(os.path.join(src, "user-{0}.yaml".format(engine)), yaml.safe_dump({"database": database}, default_flow_style=False))
+
+def generate_project(folder, pages=100, depth=2, fanout=3, inheritance=3, paragraphs=6, rows=1000, assets=30, asset_size=4096, engine="yaml", seed=0):
+	"""
+	write a synthetic project to folder, replacing anything already there
+
+	parameters:
+		pages=100: number of markdown pages, spread evenly over the sections
+		depth=2: how deeply the sections are nested
+		fanout=3: number of subsections in each section
+		inheritance=3: length of the chain of templates that pages extend
+		paragraphs=6: paragraphs of text in each page
+		rows=1000: number of rows in each database
+		assets=30: number of asset files
+		asset_size=4096: size of each asset file, in bytes
+		engine="yaml": database engine used by the index view (one of ENGINES)
+		seed=0: seed for the random text and data
+	"""
+
+	if engine not in ENGINES:
+		raise ValueError("{0} is not a recognized database engine".format(engine))
+
+	if os.path.exists(folder):
+		shutil.rmtree(folder)
+
+	src = os.path.join(folder, "src")
+	os.makedirs(src)
+
+	sections = _sections(depth, fanout)
+	page_list = [(sections[i % len(sections)], "page{0}.html".format(i)) for i in range(pages)]
+
+	views = [
+		{
+			"route": "index.html",
+			"template": "index.html",
+			"pages": [],
+			"query": QUERIES[engine]
+		},
+		{
+			"route": "",
+			"template": "page.html",
+			"context_processor": "callbacks:page",
+			"subviews": _section_views([], page_list)
+		}
+	]
+
+	_write(os.path.join(src, "settings.yaml"), yaml.safe_dump({
+		"environment": {
+			"assets": "assets",
+			"pages": "pages",
+			"templates": "templates",
+			"user": "user.yaml",
+			"views": "views.yaml"
+		},
+		"pages": {"extension_options": {}, "extensions": []},
+		"templates": {"builtins": ["len", "range"], "default_block": "content"}
+	}, default_flow_style=False))
+
+	_write(os.path.join(src, "views.yaml"), yaml.safe_dump(views, default_flow_style=False))
+	_write(os.path.join(src, "callbacks.py"), CALLBACKS)
+
+	write_templates(src, inheritance)
+	write_pages(src, page_list, paragraphs, seed)
+	write_assets(src, assets, asset_size, seed)
+	write_databases(src, make_rows(rows, seed))
+
+	shutil.copy(os.path.join(src, "user-{0}.yaml".format(engine)), os.path.join(src, "user.yaml"))
+
+	return folder
+
+def add_arguments(parser):
+	""" add the size of the project to an argparse parser """
+
+	parser.add_argument("--pages", type=int, default=100, help="number of markdown pages")
+	parser.add_argument("--depth", type=int, default=2, help="nesting depth of the sections")
+	parser.add_argument("--fanout", type=int, default=3, help="subsections in each section")
+	parser.add_argument("--inheritance", type=int, default=3, help="depth of the template inheritance chain")
+	parser.add_argument("--paragraphs", type=int, default=6, help="paragraphs in each page")
+	parser.add_argument("--rows", type=int, default=1000, help="rows in each database")
+	parser.add_argument("--assets", type=int, default=30, help="number of asset files")
+	parser.add_argument("--asset-size", type=int, default=4096, help="size of each asset file, in bytes")
+	parser.add_argument("--engine", choices=ENGINES, default="yaml", help="database engine used to build the site")
+	parser.add_argument("--seed", type=int, default=0, help="random seed")
+
+def project_arguments(args):
+	""" return the keyword arguments for generate_project from parsed arguments """
+
+	return {
+		"pages": args.pages,
+		"depth": args.depth,
+		"fanout": args.fanout,
+		"inheritance": args.inheritance,
+		"paragraphs": args.paragraphs,
+		"rows": args.rows,
+		"assets": args.assets,
+		"asset_size": args.asset_size,
+		"engine": args.engine,
+		"seed": args.seed
+	}
+
+def main(argv=None):
+
+	parser = argparse.ArgumentParser(description="generate a synthetic gansa project")
+	parser.add_argument("folder", help="folder to write the project to (its contents are replaced)")
+	add_arguments(parser)
+	args = parser.parse_args(argv)
+
+	generate_project(args.folder, **project_arguments(args))
+	print("generated {0}".format(args.folder))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,342 @@
+#!/usr/bin/env python
+
+# This file is part of Gansa.
+
+# Gansa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Gansa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Gansa.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+time loading, building, querying and serving a synthetic gansa project
+
+usage: python -m benchmarks.run [options]
+
+results are written as json, so that runs from different commits can be
+compared with --compare.
+"""
+
+from __future__ import print_function
+import os, sys, json, shutil, argparse, tempfile, threading, platform, subprocess, timeit, datetime
+import six
+
+import gansa
+from gansa import server
+from benchmarks import generate
+
+def _stats(runs):
+
+	ordered = sorted(runs)
+
+	return {
+		"runs": runs,
+		"min": ordered[0],
+		"median": ordered[len(ordered) // 2],
+		"mean": sum(ordered) / len(ordered)
+	}
+
+def _time(function, repeat=1):
+	""" call function repeat times, and return the seconds each call took """
+
+	runs = []
+	for _ in range(repeat):
+		start = timeit.default_timer()
+		function()
+		runs.append(timeit.default_timer() - start)
+
+	return runs
+
+def _clean(folder):
+
+	for name in ("distribute", "cache"):
+		path = os.path.join(folder, name)
+		if os.path.exists(path):
+			shutil.rmtree(path)
+
+def bench_load(folder, repeat):
+	""" time Site.load_environment """
+
+	site = gansa.Site(folder)
+	return {"load environment": _stats(_time(site.load_environment, repeat))}
+
+def bench_build(folder, repeat, jobs=1):
+	""" time cold, warm and no-op incremental builds """
+
+	results = {}
+
+	def cold():
+		_clean(folder)
+		gansa.Site(folder).build(jobs=jobs)
+
+	results["build cold"] = _stats(_time(cold, repeat))
+
+	site = gansa.Site(folder)
+	site.build(jobs=jobs)
+	results["build warm"] = _stats(_time(lambda: site.build(jobs=jobs), repeat))
+
+	site.build(incremental=True, force=True, jobs=jobs)
+	results["build incremental unchanged"] = _stats(_time(lambda: site.build(incremental=True, jobs=jobs), repeat))
+
+	results["pages rendered"] = site.stats["pages rendered"] + site.stats["pages unchanged"]
+
+	return results
+
+def _connect_mongomock(src, rows):
+	""" connect mongoengine to an in-memory mongomock database holding rows, or return None """
+
+	try:
+		import mongoengine, mongomock
+	except ImportError:
+		return None
+
+	try:
+		connection = mongoengine.connect("gansa-benchmark", mongo_client_class=mongomock.MongoClient)
+	except TypeError:
+		# older versions of mongoengine only accept mongomock urls
+		connection = mongoengine.connect("gansa-benchmark", host="mongomock://localhost")
+
+	if src not in sys.path:
+		sys.path.append(src)
+	import mongomodels
+
+	mongomodels.Post.drop_collection()
+	for row in rows:
+		row = dict(row)
+		del row["id"]
+		mongomodels.Post(**row).save()
+
+	return connection
+
+def bench_queries(folder, engines, repeat, rows, seed=0):
+	""" time loading each database engine, and running the index query on it """
+
+	results = {}
+	site = gansa.Site(folder)
+	src = site.environment_src
+
+	for engine in engines:
+		query = generate.QUERIES[engine]
+
+		if engine == "mongodb":
+			start = timeit.default_timer()
+			connection = _connect_mongomock(src, generate.make_rows(rows, seed))
+			if connection == None:
+				results["query mongodb"] = {"skipped": "mongoengine and mongomock are required"}
+				continue
+			site.user_settings = {"database": dict(generate.USER_SETTINGS["mongodb"])}
+			site.db = connection
+			load = [timeit.default_timer() - start]
+		else:
+			site.load_user_settings(os.path.join(src, "user-{0}.yaml".format(engine)))
+			load = _time(site.load_db, 1)
+
+		def run():
+			# the result memo would turn every query after the first into a lookup
+			site._query_results = {}
+			result = site.query_db(query)
+			# force lazy results, such as mongoengine querysets, to run
+			return len(list(result))
+
+		count = run()
+
+		results["load db " + engine] = _stats(load)
+		results["query " + engine] = _stats(_time(run, repeat))
+		results["query " + engine]["rows"] = count
+
+	return results
+
+def _fetch(host, port, paths, etags, revalidate, latencies, errors):
+
+	connection = six.moves.http_client.HTTPConnection(host, port, timeout=30)
+
+	try:
+		for path in paths:
+			headers = {"If-None-Match": etags[path]} if revalidate and path in etags else {}
+			start = timeit.default_timer()
+			connection.request("GET", path, headers=headers)
+			response = connection.getresponse()
+			response.read()
+			latencies.append(timeit.default_timer() - start)
+
+			if response.status not in (200, 304):
+				errors.append("{0} {1}".format(response.status, path))
+			elif not revalidate:
+				etags[path] = response.getheader("ETag")
+	finally:
+		connection.close()
+
+def bench_serve(folder, requests, concurrency):
+	""" time serving the built site over persistent connections """
+
+	site = gansa.Site(folder)
+	site.build()
+
+	dist = site.environment_dist
+	paths = [route for route in site.routes] + [
+		"/" + os.path.relpath(os.path.join(dirpath, f), dist).replace(os.sep, "/")
+		for dirpath, dirnames, filenames in os.walk(dist)
+		for f in filenames if not f.endswith(".html")
+	]
+
+	cwd = os.getcwd()
+	os.chdir(dist)
+
+	class Handler(server.RequestHandler):
+		def log_message(self, *args):
+			pass
+
+	httpd = server.ThreadingServer(("127.0.0.1", 0), Handler)
+	host, port = httpd.server_address
+	thread = threading.Thread(target=httpd.serve_forever)
+	thread.daemon = True
+	thread.start()
+
+	results = {}
+	etags = {}
+
+	try:
+		for name, revalidate in (("serve", False), ("serve revalidate", True)):
+			latencies = []
+			errors = []
+			clients = []
+
+			for i in range(concurrency):
+				client_paths = [paths[(i + j * concurrency) % len(paths)] for j in range(requests // concurrency)]
+				clients.append(threading.Thread(
+					target=_fetch,
+					args=(host, port, client_paths, etags, revalidate, latencies, errors)
+				))
+
+			start = timeit.default_timer()
+			for client in clients:
+				client.start()
+			for client in clients:
+				client.join()
+			elapsed = timeit.default_timer() - start
+
+			latencies.sort()
+			results[name] = {
+				"requests": len(latencies),
+				"errors": len(errors),
+				"seconds": elapsed,
+				"requests per second": len(latencies) / elapsed,
+				"latency median": latencies[len(latencies) // 2],
+				"latency 99th percentile": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+			}
+	finally:
+		httpd.shutdown()
+		httpd.server_close()
+		os.chdir(cwd)
+
+	return results
+
+def _commit():
+
+	try:
+		with open(os.devnull, "w") as devnull:
+			return subprocess.check_output(
+				["git", "rev-parse", "HEAD"],
+				cwd=os.path.dirname(os.path.abspath(__file__)),
+				stderr=devnull
+			).decode("ascii").strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+def _value(result):
+	""" return the number that summarizes a result, and whether larger is better """
+
+	if "requests per second" in result:
+		return result["requests per second"], True
+	return result.get("median"), False
+
+def compare(old, new):
+	""" return a table comparing the results of two runs """
+
+	lines = ["{0:<32} {1:>12} {2:>12} {3:>8}".format("benchmark", "before", "after", "change")]
+
+	for name in sorted(new["results"]):
+		before, after = old["results"].get(name), new["results"][name]
+		if not isinstance(after, dict) or not isinstance(before, dict):
+			continue
+
+		(b, higher_is_better), (a, _) = _value(before), _value(after)
+		if not a or not b:
+			continue
+
+		# throughputs are compared as the time each request takes
+		change = ((b / a if higher_is_better else a / b) - 1) * 100
+		lines.append("{0:<32} {1:>12.4f} {2:>12.4f} {3:>+7.1f}%".format(name, b, a, change))
+
+	lines.append("(change is the increase in time; negative is faster)")
+
+	return "\n".join(lines)
+
+def main(argv=None):
+
+	parser = argparse.ArgumentParser(description="benchmark gansa on a synthetic project")
+	generate.add_arguments(parser)
+	parser.add_argument("--project", help="folder to generate the project in (a temporary folder by default)")
+	parser.add_argument("--keep", action="store_true", default=False, help="keep the generated project")
+	parser.add_argument("--repeat", type=int, default=3, help="number of times each benchmark is run")
+	parser.add_argument("--jobs", type=int, default=1, help="number of processes used to render pages")
+	parser.add_argument("--query-engines", default=",".join(generate.ENGINES), help="comma-separated database engines to query")
+	parser.add_argument("--requests", type=int, default=1000, help="number of requests sent to the server")
+	parser.add_argument("--concurrency", type=int, default=8, help="number of concurrent clients")
+	parser.add_argument("--skip", default="", help="comma-separated benchmarks to skip (load, build, query, serve)")
+	parser.add_argument("-o", "--out", help="file to write the results to (standard output by default)")
+	parser.add_argument("--compare", help="results of an earlier run to compare with")
+	args = parser.parse_args(argv)
+
+	project = generate.project_arguments(args)
+	folder = args.project or tempfile.mkdtemp(prefix="gansa-benchmark-")
+	skip = set(filter(None, args.skip.split(",")))
+
+	generate.generate_project(folder, **project)
+
+	results = {}
+	try:
+		if "load" not in skip:
+			results.update(bench_load(folder, args.repeat))
+		if "build" not in skip:
+			results.update(bench_build(folder, args.repeat, args.jobs))
+		if "query" not in skip:
+			engines = [e for e in args.query_engines.split(",") if e]
+			results.update(bench_queries(folder, engines, args.repeat, args.rows, args.seed))
+		if "serve" not in skip:
+			results.update(bench_serve(folder, args.requests, args.concurrency))
+	finally:
+		if not args.keep and not args.project:
+			shutil.rmtree(folder)
+
+	report = {
+		"commit": _commit(),
+		"date": datetime.datetime.utcnow().isoformat(),
+		"python": platform.python_version(),
+		"platform": platform.platform(),
+		"project": project,
+		"jobs": args.jobs,
+		"repeat": args.repeat,
+		"results": results
+	}
+
+	if args.out:
+		with open(args.out, "w") as f:
+			json.dump(report, f, indent=2, sort_keys=True)
+	else:
+		json.dump(report, sys.stdout, indent=2, sort_keys=True)
+		print()
+
+	if args.compare:
+		with open(args.compare) as f:
+			print(compare(json.load(f), report), file=sys.stderr)
+
+if __name__ == "__main__":
+	main()
@@ -2,19 +2,24 @@ import models
 import datetime
 from six.moves import input
 
-def blog_post(context, view, site):
-
-    post = site.db.query(models.BlogPost).filter_by(url=view["route"]).first()
-    context = dict(context)
-
-    if not post:
-        # use site.g to store data that will be shared with other callbacks
-        site.g["unpublished_posts"] = site.g.get("unpublished_posts", [])
-        site.g["unpublished_posts"].append({"url": view["route"]})
-    else:
-        context["date_published"] = post.date_published
-
-    return context
+def blog_posts(views, site):
+
+    # look up every post in one query, instead of one query per post
+    routes = [view["route"] for view in views]
+    posts = site.db.query(models.BlogPost).filter(models.BlogPost.url.in_(routes)).all()
+    dates = dict((post.url, post.date_published) for post in posts)
+    contexts = {}
+
+    for route in routes:
+        if route in dates:
+            contexts[route] = {"date_published": dates[route]}
+        else:
+            # use site.g to store data that will be shared with other callbacks
+            site.g["unpublished_posts"] = site.g.get("unpublished_posts", [])
+            site.g["unpublished_posts"].append({"url": route})
+
+    # the context of each post is found by its route
+    return contexts
 
 def blog_index(context, view, site):
 
@@ -16,9 +16,23 @@
 # along with Gansa.  If not, see <http://www.gnu.org/licenses/>.
 
 from __future__ import print_function
-import sys, os, collections, shutil, csv, functools, copy, importlib, codecs
-import jinja2, markdown, yaml, sqlalchemy, sqlalchemy.orm, mongoengine, six
+import sys, os, io, time, collections, shutil, copy, importlib, codecs, hashlib, json, threading, functools
+import jinja2, jinja2.meta, markdown, yaml, six
+
+try:
+	from collections.abc import Mapping, Iterable
+except ImportError:
+	# python 2
+	from collections import Mapping, Iterable
+
+# database engines, pyjade and multiprocessing are slow to import, and are
+# only imported by the methods that need them
 from markdown.extensions.meta import MetaExtension
+from gansa.table import compile_condition, read_csv
+from gansa.timing import Profiler, NullProfiler
+from gansa.pages import PageIndex, read_meta
+from gansa.files import atomic_write, replace_file, temp_name
+from gansa.assets import AssetCopier, AssetHashes, hash_file, is_current, fingerprint, should_fingerprint
 
 TMP_TEMPLATE = """
 {{% extends '{0}' %}}
@@ -27,11 +41,52 @@ TMP_TEMPLATE = """
 {{% endblock %}}
 """
 
-SUPPORTED_DB_ENGINES = {"yaml", "sqlite", "postgresql", "mysql", "csv", "mongodb"}
+SUPPORTED_DB_ENGINES = {"yaml", "json", "msgpack", "sqlite", "postgresql", "mysql", "csv", "mongodb"}
+
+# view parameters that subviews inherit from their parents, and their defaults
+INHERITED_VIEW_PARAMETERS = (
+	("template", ""),
+	("context", {}),
+	("context_processor", ""),
+	("context_processor_batch", ""),
+	("pages", None)
+)
+
+# the libyaml parser is several times faster, but is not always installed
+YAML_LOADER = getattr(yaml, "CLoader", yaml.Loader)
+
+# parsed yaml files at least this large are kept in the cache folder
+YAML_CACHE_MIN_SIZE = 64 * 1024
+
+# number of converted markdown pages kept in memory
+PAGE_CACHE_SIZE = 256
+
+# number of chunks jinja gathers before a streamed page is written out
+STREAM_BUFFER_SIZE = 40
+
+# number of rows fetched at a time by streamed sql queries
+STREAM_YIELD_PER = 1000
+
+# user.yaml database.pool options, and the create_engine arguments they become
+SQL_POOL_OPTIONS = {
+	"size": "pool_size",
+	"max_overflow": "max_overflow",
+	"timeout": "pool_timeout",
+	"recycle": "pool_recycle",
+	"pre_ping": "pool_pre_ping"
+}
+
+# user.yaml database.pool options, and the pymongo client arguments they become
+MONGODB_POOL_OPTIONS = {
+	"size": ("maxPoolSize", 1),
+	"timeout": ("waitQueueTimeoutMS", 1000),
+	"connect_timeout": ("connectTimeoutMS", 1000),
+	"server_selection_timeout": ("serverSelectionTimeoutMS", 1000)
+}
 
 def _deep_update(dict1, dict2):
 	for k, v in dict2.items():
-		if isinstance(v, collections.Mapping):
+		if isinstance(v, Mapping):
 			r = _deep_update(dict1.get(k, {}), v)
 			dict1[k] = r
 		else:
@@ -45,7 +100,7 @@ def _tonumber(s):
 		return float(s)
 
 def _collection(item):
-	if not isinstance(item, collections.Iterable) or isinstance(item, six.string_types):
+	if not isinstance(item, Iterable) or isinstance(item, six.string_types):
 		item = [item]
 	return item
 
@@ -63,6 +118,186 @@ def _eval_module_and_object(s):
 
 	return module, o
 
+def _hash_bytes(b):
+	return hashlib.sha1(b).hexdigest()
+
+def _hash_object(o):
+	return _hash_bytes(json.dumps(o, sort_keys=True, default=repr).encode("utf-8"))
+
+def _remove_empty_dirs(path, root):
+	""" remove path and its parents, stopping at root or the first nonempty folder """
+
+	root = os.path.abspath(root)
+	path = os.path.abspath(path)
+
+	while path != root and path.startswith(root):
+		try:
+			os.rmdir(path)
+		except OSError:
+			return
+		path = os.path.dirname(path)
+
+def _load_yaml(fname, cache_folder=None):
+	"""
+	parse a yaml file
+
+	if cache_folder is given, large files are pickled into it once they are
+	parsed, and loaded from the pickle for as long as they keep the same size
+	and modification time
+	"""
+
+	st = os.stat(fname)
+	cache_fname = None
+
+	if cache_folder and st.st_size >= YAML_CACHE_MIN_SIZE:
+		cache_fname = os.path.join(cache_folder, _hash_bytes(os.path.abspath(fname).encode("utf-8")) + ".pickle")
+		try:
+			with open(cache_fname, "rb") as stream:
+				size, mtime, data = six.moves.cPickle.load(stream)
+			if size == st.st_size and mtime == st.st_mtime:
+				return data
+		except (IOError, OSError, EOFError, TypeError, ValueError, six.moves.cPickle.UnpicklingError):
+			pass
+
+	with open(fname) as stream:
+		data = yaml.load(stream, Loader=YAML_LOADER)
+
+	if cache_fname:
+		try:
+			with atomic_write(cache_fname) as stream:
+				six.moves.cPickle.dump((st.st_size, st.st_mtime, data), stream, six.moves.cPickle.HIGHEST_PROTOCOL)
+		except (six.moves.cPickle.PicklingError, TypeError, AttributeError):
+			pass
+
+	return data
+
+def _merge_g(g, other):
+	""" merge the g table of a worker process into g """
+
+	for k, v in other.items():
+		if isinstance(g.get(k), list) and isinstance(v, list):
+			g[k].extend(v)
+		elif isinstance(g.get(k), Mapping) and isinstance(v, Mapping):
+			g[k].update(v)
+		else:
+			g[k] = v
+
+	return g
+
+_worker_site = None
+
+def _init_worker(environment, settings, user_settings, views, asset_map, pages, profile):
+	""" give a worker process its own site, template environment, markdown converter and database connection """
+
+	global _worker_site
+
+	site = Site(environment, load=False, profiler=Profiler() if profile else None)
+	site.settings = settings
+	site.user_settings = user_settings
+	# context processors see the same views and routes as in a serial build
+	site.views = views
+	site._compile_views()
+	site.asset_map = asset_map
+	site.pages = pages
+	sys.path.append(site.environment_src)
+
+	site.load_templates()
+	site.load_db()
+	site._load_query_snapshots()
+	site._load_page_cache()
+	site._md = site._markdown()
+
+	_worker_site = site
+
+def _build_view_in_worker(args):
+
+	view, out, batch_context = args
+	site = _worker_site
+
+	# each view gets a fresh g table, which is merged into the parent's in view order
+	site.g = {}
+	site.stats.clear()
+	site.profiler.events = []
+	site._page_index_routes = set()
+	site._build_view(view, out, site._md, batch_context)
+	# give the connection back to the worker's pool between views
+	site._close_db_session()
+
+	return site.g, site.stats, site.profiler.events, site._page_index_routes
+
+# database connections are made once per process, and shared by every site
+# and build in it (e.g. the rebuilds of a watching server)
+_sql_engines = {}
+_mongodb_connections = {}
+
+def _pool_options(pool, names):
+
+	for k in pool:
+		if k not in names:
+			raise ValueError("{0} is not a recognized pool option".format(k))
+
+	return pool
+
+def _sql_engine(uri, pool):
+	""" return the sqlalchemy engine for uri, creating it the first time it is asked for in this process """
+
+	import sqlalchemy
+
+	key = (os.getpid(), uri, _hash_object(pool))
+
+	if key not in _sql_engines:
+		options = dict((SQL_POOL_OPTIONS[k], v) for k, v in _pool_options(pool, SQL_POOL_OPTIONS).items())
+		_sql_engines[key] = sqlalchemy.create_engine(uri, **options)
+
+	return _sql_engines[key]
+
+def _mongodb_connection(uri, pool):
+	""" return the mongoengine connection to uri, connecting the first time it is asked for in this process """
+
+	import mongoengine
+
+	key = (os.getpid(), uri, _hash_object(pool))
+
+	if key not in _mongodb_connections:
+		# clients inherited from a parent process, or made with other settings, cannot be reused
+		mongoengine.disconnect()
+		_mongodb_connections.clear()
+
+		options = {}
+		for k, v in _pool_options(pool, MONGODB_POOL_OPTIONS).items():
+			name, scale = MONGODB_POOL_OPTIONS[k]
+			options[name] = v * scale
+
+		_mongodb_connections[key] = mongoengine.connect(host=uri, **options)
+
+	return _mongodb_connections[key]
+
+def _query_key(query):
+	""" return a normalized form of a query spec, suitable for use as a dict key """
+
+	if query == None or isinstance(query, six.string_types):
+		return query
+
+	return json.dumps(query, sort_keys=True, default=repr)
+
+def _row_value(row, key):
+	""" return a column of a query result row, whether it is a mapping or an object """
+
+	try:
+		return row[key]
+	except (KeyError, IndexError, TypeError):
+		return getattr(row, key)
+
+def _route_value(value):
+	""" return a pagination key value as text that is safe to put in a route """
+
+	# a path separator would put the page in a folder of its own
+	text = six.text_type(value).replace("/", "-").replace("\\", "-")
+	if not text.strip("."):
+		raise ValueError("{0!r} cannot be used in a route".format(value))
+
+	return text
+
 def _path_splitall(path):
 
 	folders = []
@@ -98,6 +333,308 @@ class BlockTable(object):
 
 		return template
 
+class Route(object):
+	""" entry in a site's route table: a view that has no subviews, and the folder (relative to the output) its page goes in """
+
+	__slots__ = ("view", "folder")
+
+	def __init__(self, view, folder):
+		self.view = view
+		self.folder = folder
+
+	@property
+	def full_route(self):
+		return self.view["full_route"]
+
+class TemplateLoader(jinja2.FileSystemLoader):
+
+	def load(self, environment, name, globals=None):
+
+		stats = getattr(environment, "stats", None)
+		if stats != None:
+			stats["template cache misses"] += 1
+
+		return jinja2.FileSystemLoader.load(self, environment, name, globals)
+
+class TemplateEnvironment(jinja2.Environment):
+	""" jinja environment that keeps count of how often its caches are used """
+
+	def __init__(self, stats=None, **kwargs):
+		jinja2.Environment.__init__(self, **kwargs)
+		self.stats = collections.Counter() if stats == None else stats
+
+	def get_template(self, name, *args, **kwargs):
+		self.stats["template lookups"] += 1
+		return jinja2.Environment.get_template(self, name, *args, **kwargs)
+
+class BytecodeCache(jinja2.FileSystemBytecodeCache):
+	"""
+	bytecode cache that keeps compiled templates between builds
+
+	entries are keyed by template name and path, and are discarded whenever a
+	hash of the template source no longer matches
+	"""
+
+	def load_bytecode(self, bucket):
+
+		jinja2.FileSystemBytecodeCache.load_bytecode(self, bucket)
+
+		stats = getattr(bucket.environment, "stats", None)
+		if stats != None:
+			stats["bytecode cache hits" if bucket.code != None else "bytecode cache misses"] += 1
+
+class PageCache(object):
+	"""
+	cache of converted markdown pages, keyed by a hash of the page source
+
+	the size most recently used pages are kept in memory, and every page is
+	stored in folder (if given) so that later builds can reuse them. version
+	identifies the markdown settings the pages were converted with.
+	"""
+
+	def __init__(self, folder=None, version="", size=PAGE_CACHE_SIZE):
+		self.folder = folder
+		self.version = version
+		self.size = size
+		self.pages = collections.OrderedDict()
+
+	def _fname(self, key):
+		return os.path.join(self.folder, self.version, key[:2], key + ".json")
+
+	def get(self, key):
+		""" return the (html, meta) pair stored for key, or None """
+
+		page = self.pages.pop(key, None)
+		if page != None:
+			self._remember(key, page)
+			return page
+
+		if not self.folder:
+			return None
+
+		try:
+			with codecs.open(self._fname(key), mode="r", encoding="utf-8") as stream:
+				data = json.load(stream)
+		except (IOError, OSError, ValueError):
+			return None
+
+		page = (data["html"], data["meta"])
+		self._remember(key, page)
+		return page
+
+	def _remember(self, key, page):
+		""" keep page in memory, forgetting the least recently used page if the cache is full """
+
+		self.pages[key] = page
+		while len(self.pages) > self.size:
+			self.pages.popitem(last=False)
+
+	def set(self, key, page):
+
+		self.pages.pop(key, None)
+		self._remember(key, page)
+		if not self.folder:
+			return
+
+		with atomic_write(self._fname(key), mode="w", encoding="utf-8") as stream:
+			json.dump({"html": page[0], "meta": page[1]}, stream)
+
+class QuerySnapshots(object):
+	"""
+	query results stored on disk, so that builds can reuse them instead of
+	querying a database server again
+
+	each snapshot is a pickle file in folder/version, where version identifies
+	the database. a snapshot is valid for ttl seconds (forever if ttl is None),
+	and only as long as the result of the database's change-detection query
+	(check) stays the same. snapshots are only read when a query asks for them.
+	"""
+
+	def __init__(self, folder, version="", ttl=None):
+		self.folder = folder
+		self.version = version
+		self.ttl = ttl
+
+	def _fname(self, key):
+		return os.path.join(self.folder, self.version, _hash_bytes(key.encode("utf-8")) + ".pickle")
+
+	def get(self, key, check=None):
+		""" return a dict holding the result stored for key, or None if there is no valid snapshot """
+
+		try:
+			with open(self._fname(key), "rb") as stream:
+				snapshot = six.moves.cPickle.load(stream)
+		except (IOError, OSError, EOFError, ValueError, six.moves.cPickle.UnpicklingError):
+			return None
+
+		if snapshot["check"] != check:
+			return None
+		if self.ttl != None and time.time() - snapshot["time"] > self.ttl:
+			return None
+
+		return snapshot
+
+	def set(self, key, result, check=None):
+		""" store result for key; returns False if the result cannot be pickled """
+
+		try:
+			with atomic_write(self._fname(key)) as stream:
+				six.moves.cPickle.dump(
+					{"time": time.time(), "check": check, "result": result},
+					stream,
+					six.moves.cPickle.HIGHEST_PROTOCOL
+				)
+		except (six.moves.cPickle.PicklingError, TypeError, AttributeError):
+			return False
+
+		return True
+
+	def clear(self):
+
+		folder = os.path.join(self.folder, self.version)
+		if os.path.exists(folder):
+			shutil.rmtree(folder)
+
+class StreamedQuery(object):
+	"""
+	result of a sql query that is fetched yield_per rows at a time, through a
+	server-side cursor where the database supports one
+
+	every iteration runs the query again, so rows are never all held in memory.
+	taking the length of the result or indexing it fetches every row and keeps
+	them.
+	"""
+
+	def __init__(self, query, yield_per=1000):
+		self.query = query
+		self.yield_per = yield_per
+		self._rows = None
+
+	def __iter__(self):
+
+		if self._rows != None:
+			return iter(self._rows)
+
+		return iter(self.query.execution_options(stream_results=True).yield_per(self.yield_per))
+
+	def __len__(self):
+		return len(self.all())
+
+	def __getitem__(self, index):
+		return self.all()[index]
+
+	def __bool__(self):
+
+		if self._rows != None:
+			return bool(self._rows)
+
+		# first() would replace the query's own limit with its own
+		return self.query.session.query(self.query.exists()).scalar()
+
+	__nonzero__ = __bool__
+
+	def all(self):
+		""" fetch and keep every row """
+
+		if self._rows == None:
+			self._rows = self.query.all()
+
+		return self._rows
+
+class OutputFile(object):
+	"""
+	file that a page is rendered into
+
+	text is written to a temporary file, which replaces fname when the file is
+	closed, unless fname already has the same contents; this keeps the
+	modification times of unchanged pages stable. if rendering fails, fname is
+	left as it was.
+	"""
+
+	def __init__(self, fname, buffer_size=65536):
+		self.fname = fname
+		self.tmp_fname = temp_name(fname)
+		self.stream = io.open(self.tmp_fname, mode="wb", buffering=buffer_size)
+		self.changed = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+
+		if exc_type:
+			self.stream.close()
+			os.remove(self.tmp_fname)
+		else:
+			self.close()
+
+		return False
+
+	def write(self, text):
+		self.stream.write(text.encode("utf-8"))
+
+	def close(self):
+
+		self.stream.close()
+		self.changed = not self._same_contents()
+
+		if self.changed:
+			replace_file(self.tmp_fname, self.fname)
+		else:
+			os.remove(self.tmp_fname)
+
+	def _same_contents(self):
+
+		try:
+			if os.path.getsize(self.fname) != os.path.getsize(self.tmp_fname):
+				return False
+		except OSError:
+			return False
+
+		with open(self.fname, "rb") as old:
+			with open(self.tmp_fname, "rb") as new:
+				while True:
+					a, b = old.read(65536), new.read(65536)
+					if a != b:
+						return False
+					if not a:
+						return True
+
+class BuildManifest(object):
+	""" record of the inputs that each output file of a build was created from """
+
+	version = 1
+
+	def __init__(self, fname, key=None):
+		self.fname = fname
+		self.key = key
+		self.outputs = {}
+
+	def load(self):
+		""" load the manifest from disk, returning False if it is missing or unreadable """
+
+		try:
+			with open(self.fname) as stream:
+				data = json.load(stream)
+		except (IOError, OSError, ValueError):
+			return False
+
+		if data.get("version") != self.version:
+			return False
+
+		self.key = data.get("key")
+		self.outputs = data.get("outputs", {})
+		return True
+
+	def save(self):
+
+		with atomic_write(self.fname, mode="w") as stream:
+			json.dump({"version": self.version, "key": self.key, "outputs": self.outputs}, stream, sort_keys=True)
+
+	def is_current(self, fname, record):
+		""" return True if fname was last built from the inputs described by record """
+		return record is not None and self.outputs.get(fname) == record
+
 class Site(object):
 
 	default_settings = {
@@ -111,10 +648,29 @@ class Site(object):
 		"pages": {
 			"extensions": [],
 			"extension_options": {},
+			"cache": False
 		},
 		"templates": {
 			"default_block": "content",
-			"builtins": []
+			"builtins": [],
+			"cache_size": 400,
+			"stream": False,
+			"bytecode_cache": False,
+			"jade": None
+		},
+		"assets": {
+			"link": "copy",
+			"hash": False,
+			"background": False,
+			"fingerprint": False,
+			"manifest": "assets.json",
+			"url": "/"
+		},
+		"publish": {
+			"target": "",
+			"jobs": 4,
+			"compress": [],
+			"compress_types": ["*.html", "*.css", "*.js", "*.json", "*.xml", "*.svg", "*.txt"]
 		},
 		"callbacks": {
 			"postrender": ""
@@ -125,13 +681,30 @@ class Site(object):
 		"database": {}
 	}
 
-	def __init__(self, environment, load=True):
+	def __init__(self, environment, load=True, profiler=None):
+		"""
+		parameters:
+			environment: project folder
+			load=True: load the project's settings, templates, views and database
+			profiler=None: gansa.Profiler used to time the phases of each build
+		"""
 
 		self.environment = os.path.abspath(environment)
 		self.settings = copy.deepcopy(self.default_settings)
 		self.user_settings = copy.deepcopy(self.default_user_settings)
 		self.views = []
+		self.route_table = []
+		self.route_index = {}
+		self._query_plans = {}
+		self._callables = {}
 		self.db = {}
+		self.stats = collections.Counter()
+		self.page_cache = PageCache()
+		self.query_snapshots = None
+		self.asset_map = {}
+		self.pages = PageIndex(self._scan_pages)
+		self._page_index_routes = set()
+		self.profiler = profiler or NullProfiler()
 
 		if not load or not os.path.exists(self.environment_src):
 			return
@@ -142,11 +715,15 @@ class Site(object):
 
 	def load_environment(self):
 
-		self.load_settings()
-		self.load_user_settings()
-		self.load_templates()
-		self.load_views()
-		self.load_db()
+		with self.profiler.phase("load settings"):
+			self.load_settings()
+			self.load_user_settings()
+		with self.profiler.phase("load templates"):
+			self.load_templates()
+		with self.profiler.phase("load views"):
+			self.load_views()
+		with self.profiler.phase("load db"):
+			self.load_db()
 
 	def load_db(self):
 
@@ -155,69 +732,147 @@ class Site(object):
 			return
 
 		if db_engine == "yaml":
+			self.db = self._load_yaml(os.path.join(self.environment_src, self.user_settings["database"]["uri"])) or {}
+		elif db_engine == "json":
 			with open(os.path.join(self.environment_src, self.user_settings["database"]["uri"])) as stream:
-				self.db = yaml.load(stream) or {}
+				self.db = json.load(stream) or {}
+		elif db_engine == "msgpack":
+			import msgpack
+
+			with open(os.path.join(self.environment_src, self.user_settings["database"]["uri"]), "rb") as stream:
+				try:
+					self.db = msgpack.unpack(stream, raw=False) or {}
+				except TypeError:
+					# msgpack before 0.5.2
+					stream.seek(0)
+					self.db = msgpack.unpack(stream, encoding="utf-8") or {}
 		elif db_engine == "csv":
 			db_fnames = _collection(self.user_settings["database"]["uri"])
 
 			store_row_as = self.user_settings["database"].get("store_row_as", "array")
-			self.db = {}
+			convert = self.user_settings["database"].get("convert_numbers_and_bools", True)
+			indexes = self.user_settings["database"].get("indexes", {})
+			columns = self.user_settings["database"].get("columns", {})
+			chunk_size = self.user_settings["database"].get("chunk_size", 10000)
+			db = {}
+
+			if store_row_as not in ("dict", "array"):
+				raise ValueError("{0} is not a recognized csv storage format".format(store_row_as))
 
 			for fname in db_fnames:
 				with open(os.path.join(self.environment_src, fname)) as stream:
 					table_name = ".".join(fname.split(".")[:-1])
-					if store_row_as == "dict":
-						self.db[table_name] = [row for row in csv.DictReader(stream)]
-					elif store_row_as == "array":
-						self.db[table_name] = [row for row in csv.reader(stream)]
-					else:
-						raise ValueError("{0} is not a recognized csv storage format".format(store_row_as))
-
-					if self.user_settings["database"].get("convert_numbers_and_bools", True):
-						for row in self.db[table_name]:
-							if store_row_as == "dict":
-								for k, v in row.items():
-									try:
-										row[k] = _tonumber(v)
-									except:
-										row[k] = {"true":True, "false":False}.get(row[k], row[k])
-							if store_row_as == "array":
-								for i, v in enumerate(row):
-									try:
-										row[i] = _tonumber(v)
-									except:
-										row[i] = {"true":True, "false":False}.get(row[i], row[i])
+					db[table_name] = read_csv(
+						stream,
+						header=store_row_as == "dict",
+						convert=convert,
+						types=columns.get(table_name),
+						chunk_size=chunk_size
+					)
+
+				for key in _collection(indexes.get(table_name, [])):
+					db[table_name].create_index(key)
+
+			self.db = db
 		elif db_engine in ["sqlite", "postgresql", "mysql"]:
+			import sqlalchemy.orm
+
+			uri = self.user_settings["database"]["uri"]
+
 			if db_engine == "sqlite":
-				uri = self.user_settings["database"]["uri"]
 				p = uri.split("sqlite:///")[1]
 
 				if p and not os.path.isabs(p):
 					uri = "sqlite:///" + os.path.join(self.environment_src, p)
-				self.db_engine = sqlalchemy.create_engine(uri)
 
-			else:
-				self.db_engine = sqlalchemy.create_engine(self.user_settings["database"]["uri"])
+			self._close_db_session()
+			self.db_engine = _sql_engine(uri, self.user_settings["database"].get("pool") or {})
 
-			self.db = sqlalchemy.orm.sessionmaker(bind=self.db_engine)()
+			# the session is closed after each build, and after each view in a
+			# worker process, and a new one is started when it is next used
+			self.db = sqlalchemy.orm.scoped_session(sqlalchemy.orm.sessionmaker(bind=self.db_engine))
 		elif db_engine == "mongodb":
-			self.db = mongoengine.connect(host=self.user_settings["database"]["uri"])
+			self.db = _mongodb_connection(
+				self.user_settings["database"]["uri"],
+				self.user_settings["database"].get("pool") or {}
+			)
+
+	def _load_yaml(self, fname):
+		""" parse a yaml file, reusing the parse from an earlier build if the file has not changed """
+		return _load_yaml(fname, os.path.join(self.environment_cache, "yaml"))
 
 	def load_templates(self):
 
-		template_loader = jinja2.FileSystemLoader(os.path.join(self.environment_src, self.settings["environment"]["templates"]))
-		self.templates = jinja2.Environment(cache_size=0, loader=template_loader, extensions=['pyjade.ext.jinja.PyJadeExtension'])
+		template_loader = TemplateLoader(os.path.join(self.environment_src, self.settings["environment"]["templates"]))
+
+		if self.settings["templates"].get("bytecode_cache"):
+			bytecode_folder = os.path.join(self.environment_cache, "templates")
+			if not os.path.exists(bytecode_folder):
+				os.makedirs(bytecode_folder)
+			bytecode_cache = BytecodeCache(bytecode_folder)
+		else:
+			bytecode_cache = None
+
+		# the jade extension is only loaded if it is asked for, or if there are jade templates
+		jade = self.settings["templates"].get("jade")
+		if jade == None:
+			jade = any(
+				f.endswith(".jade")
+				for _, _, filenames in os.walk(template_loader.searchpath[0])
+				for f in filenames
+			)
+
+		# templates are compiled once per build, so there is no need to check
+		# them for changes every time they are used (see _build)
+		self.templates = TemplateEnvironment(
+			stats=self.stats,
+			cache_size=self.settings["templates"].get("cache_size", 400),
+			auto_reload=False,
+			bytecode_cache=bytecode_cache,
+			loader=template_loader,
+			extensions=['pyjade.ext.jinja.PyJadeExtension'] if jade else []
+		)
+		self.templates.globals["asset_url"] = self.asset_url
+		self.templates.globals["pages"] = self.pages
 
 	def load_views(self):
 
-		with open(os.path.join(self.environment_src, self.settings["environment"]["views"])) as vstream:
-			self.views = yaml.load(vstream) or []
+		self.views = self._load_yaml(os.path.join(self.environment_src, self.settings["environment"]["views"])) or []
 		self.set_view_full_routes()
+		self._compile_views()
 
-		self.set_view_parameter(self.views, "template", default_value="")
-		self.set_view_parameter(self.views, "context", default_value={})
-		self.set_view_parameter(self.views, "context_processor", default_value="")
-		self.set_view_parameter(self.views, "pages", default_value=None)
+	def _compile_views(self):
+		"""
+		give every view the parameters it inherits from its parents, and list
+		the views that have pages in route_table, in build order. route_index
+		maps full routes to their entries in the table.
+
+		each view gets a shallow copy of the mappings and lists it inherits, so
+		that changing one view's context does not change the others.
+		"""
+
+		self.route_table = []
+		self.route_index = {}
+
+		defaults = dict(INHERITED_VIEW_PARAMETERS)
+		stack = [(view, defaults, "") for view in reversed(self.views)]
+
+		while stack:
+			view, inherited, folder = stack.pop()
+
+			for k, _ in INHERITED_VIEW_PARAMETERS:
+				if view.get(k) == None:
+					value = inherited[k]
+					view[k] = copy.copy(value) if isinstance(value, (dict, list)) else value
+
+			if view.get("subviews"):
+				params = dict((k, view[k]) for k, _ in INHERITED_VIEW_PARAMETERS)
+				subfolder = os.path.join(folder, view["route"])
+				stack.extend((v, params, subfolder) for v in reversed(view["subviews"]))
+			else:
+				route = Route(view, folder)
+				self.route_table.append(route)
+				self.route_index[view["full_route"]] = route
 
 	def load_settings(self, merge=True):
 		"""
@@ -227,9 +882,8 @@ class Site(object):
 			merge=True: attempt to merge settings with already loaded settings
 		"""
 
-		with open(os.path.join(self.environment_src, "settings.yaml")) as settings_file:
-			settings = yaml.load(settings_file)
-			_deep_update(self.settings, settings)
+		settings = self._load_yaml(os.path.join(self.environment_src, "settings.yaml"))
+		_deep_update(self.settings, settings)
 
 	def load_user_settings(self, fname=""):
 
@@ -237,8 +891,7 @@ class Site(object):
 			return
 
 		fname = fname or os.path.join(self.environment_src, self.settings["environment"]["user"])
-		with open(fname) as settings_file:
-			self.user_settings = yaml.load(settings_file)
+		self.user_settings = self._load_yaml(fname)
 
 		db = self.user_settings["database"].get("uri")
 
@@ -268,6 +921,8 @@ class Site(object):
 			else:
 				engine = {
 					"yaml": "yaml",
+					"json": "json",
+					"msgpack": "msgpack",
 					"csv": "csv",
 					"sqlite": "sqlite",
 					"db": "sqlite"
@@ -311,21 +966,36 @@ class Site(object):
 	def environment_dist(self):
 		return os.path.join(self.environment, "distribute")
 
+	@property
+	def db(self):
+		return self._db
+
+	@db.setter
+	def db(self, value):
+		# query results are only valid for the database they came from
+		self._db = value
+		self._query_results = {}
+
+	@property
+	def environment_cache(self):
+		return os.path.join(self.environment, "cache")
+
 	@property
 	def routes(self):
 		return self._routes()
 
 	def _routes(self, views=None):
 
-		routeList = []
+		if views == None:
+			return [v["full_route"] for route in self.route_table for v in self._expand_view(route.view)]
 
-		views = views or self.views
+		routeList = []
 
 		for view in views:
 			if view.get("subviews"):
 				routeList += self._routes(views=view["subviews"])
 			else:
-				routeList.append(view["full_route"])
+				routeList += [v["full_route"] for v in self._expand_view(view)]
 
 		return routeList
 
@@ -361,6 +1031,15 @@ class Site(object):
 						subviews = newView["subviews"]
 					subviews.extend(originalSubviews)
 
+					# the rest of the view's parameters (e.g. its query) belong to
+					# the last component of the route
+					if len(components) > 1:
+						for k in list(view):
+							if k not in ("route", "subviews"):
+								newView[k] = view.pop(k)
+						if not newView["subviews"]:
+							del newView["subviews"]
+
 				view["full_route"] = route_prefix + view["route"]
 
 			if view.get("subviews"):
@@ -381,14 +1060,39 @@ class Site(object):
 			if view.get("subviews"):
 				self.set_view_parameter(view["subviews"], key, default_value, value=view[key])
 
-	def serve(self, host, port, user_settings_file=""):
-		""" build the site and host it on a simple HTTP server """
+	def serve(self, host, port, user_settings_file="", watch=False):
+		"""
+		build the site and host it on a multithreaded HTTP server
+
+		parameters:
+			watch=False: watch the project for changes, rebuild the affected
+				parts of the site, and reload the pages open in browsers
+		"""
+
+		from gansa import server
+
 		self.build(self.environment_dist, user_settings_file=user_settings_file)
-		handler = six.moves.SimpleHTTPServer.SimpleHTTPRequestHandler
-		six.moves.socketserver.TCPServer.allow_reuse_address = True
-		httpd = six.moves.socketserver.TCPServer((host, port), handler)
 
-		os.chdir(self.environment_dist)
+		if watch:
+			handler = type("RequestHandler", (server.RequestHandler,), {"notifier": server.ReloadNotifier()})
+
+			stop = threading.Event()
+			watcher = threading.Thread(
+				target=server.watch_site,
+				args=(self, handler.notifier, stop, self.environment_dist, user_settings_file)
+			)
+			watcher.daemon = True
+			watcher.start()
+		else:
+			handler = server.RequestHandler
+
+		if six.PY2:
+			os.chdir(self.environment_dist)
+		else:
+			# files are looked up in the output folder, not the current directory
+			handler = functools.partial(handler, directory=self.environment_dist)
+
+		httpd = server.ThreadingServer((host, port), handler)
 
 		print ("serving {} at {}:{}".format(self.environment_dist, host, port))
 
@@ -396,183 +1100,1015 @@ class Site(object):
 			httpd.serve_forever()
 		except KeyboardInterrupt:
 			print ("shutting down server")
+			if watch:
+				stop.set()
 			httpd.shutdown()
 			return
 
-	def build(self, out="", user_settings_file=""):
+	def publish(self, target="", out="", jobs=None, force=False, dry_run=False, log=None):
+		"""
+		upload the files of a built site that changed since it was last published
+		to target, and remove the files that are gone
+
+		parameters:
+			target="": where to publish the site (see gansa.publish.get_target);
+				defaults to publish.target in the user settings, then in settings.yaml
+			out="": folder the site was built in (defaults to the project's distribute folder)
+			jobs=None: number of uploads run at the same time (defaults to publish.jobs)
+			force=False: upload every file, instead of only the ones that changed
+			dry_run=False: only report what would be uploaded and removed
+			log=None: function called with a line for each uploaded or removed file
+
+		returns the stats of the publish
+		"""
 
-		return self._build(out, user_settings_file=user_settings_file)
+		from gansa.publish import Publisher
 
-	def _build(self, out="", views=None, user_settings_file=""):
+		settings = self.settings["publish"]
+		target = target or self.user_settings.get("publish", {}).get("target") or settings["target"]
+		if not target:
+			raise ValueError("no publish target given")
 
-		out = out or self.environment_dist
-		if os.path.abspath(self.environment_src) in os.path.abspath(out):
-			raise OSError("Cannot build site in source directory")
+		publisher = Publisher(
+			out or self.environment_dist,
+			target,
+			os.path.join(self.environment_cache, "publish"),
+			jobs=jobs or settings["jobs"],
+			compress=settings["compress"],
+			compress_types=settings["compress_types"]
+		)
 
-		if not os.path.exists(self.environment_src):
-			raise OSError("Cannot find source directory")
+		return publisher.publish(dry_run=dry_run, force=force, log=log)
 
-		views = views or self.views
+	def rebuild(self, fnames, out="", user_settings_file=""):
+		"""
+		rebuild only the parts of the site affected by changes to the given source files
 
-		if os.path.exists(out):
-			if views == self.views:
-				shutil.rmtree(out)
-				os.mkdir(out)
-		else:
-			os.mkdir(out)
+		a changed asset is copied on its own, and pages are rendered again for
+		the views that use a changed markdown page, the views whose templates
+		extend, include or import a changed template, and (if the database
+		changed) the views that query it. the postrender callback is not called.
+		changes to the settings or views cause an incremental build of the
+		whole site instead.
 
-		if user_settings_file:
+		returns True if anything was rebuilt
+		"""
+
+		out = out or self.environment_dist
+		src = self.environment_src
+		environment = self.settings["environment"]
+		fnames = set(os.path.abspath(f) for f in fnames)
+
+		config_fnames = {
+			os.path.join(src, environment["views"]),
+			os.path.join(src, "settings.yaml"),
+			os.path.abspath(user_settings_file) if user_settings_file else os.path.join(src, environment["user"] or "")
+		}
+
+		if fnames & config_fnames:
+			self.load_settings()
 			self.load_user_settings(user_settings_file)
+			self.load_templates()
+			self.load_views()
+			self.load_db()
+			self.build(out, incremental=True)
+			return True
+
+		def relpath(fname, folder):
+			folder = os.path.join(src, folder)
+			if fname.startswith(folder + os.sep):
+				return os.path.relpath(fname, folder)
+
+		if self.settings["assets"]["fingerprint"] and any(relpath(f, environment["assets"]) for f in fnames):
+			# a changed asset gets a new name, and the pages that link to it must follow
+			self.build(out, incremental=True)
+			return True
+
+		self.stats.clear()
+		self._query_results = {}
+		self._dependency_cache = {}
+		self._callables = {}
+		if self.templates.cache != None:
+			self.templates.cache.clear()
+
+		db_changed = bool(fnames & set(self._db_fnames()))
+		if db_changed:
+			# the pages of paginated views whose rows are gone are deleted below
+			paginated = self._paginated_outputs(out)
+			self._query_results = {}
 			self.load_db()
 
-		md = markdown.Markdown(
-			extensions = [MetaExtension()] + self.settings["pages"]["extensions"],
-			extension_configs = self.settings["pages"]["extension_options"]
-		)
+		rebuilt = False
+		pages = set()
+		templates = set()
+
+		for fname in fnames:
+			asset = relpath(fname, environment["assets"])
+			template = relpath(fname, environment["templates"])
+
+			if asset:
+				dst = os.path.join(out, asset)
+				if os.path.exists(fname):
+					AssetCopier(self.settings["assets"]["link"]).copy(fname, dst)
+				elif os.path.exists(dst):
+					os.remove(dst)
+					_remove_empty_dirs(os.path.dirname(dst), out)
+				rebuilt = True
+			elif template:
+				templates.add(template.replace(os.sep, "/"))
+			elif relpath(fname, environment["pages"]):
+				pages.add(fname)
+
+		if pages:
+			self.pages.refresh()
+
+		pending = []
+
+		for view, view_out in self._leaf_views(self.views, out):
+			if db_changed and "page" in view:
+				paginated.discard(os.path.join(view_out, view["route"]))
+
+			if pages.intersection(self._view_page_fnames(view)):
+				pass
+			elif pages and view["full_route"] in self._page_index_routes:
+				pass
+			elif db_changed and (view.get("query") or view.get("context_processor") or view.get("context_processor_batch")):
+				pass
+			elif templates:
+				deps = self._template_dependencies(view["template"])
+				if deps != None and not templates.intersection(deps):
+					continue
+			else:
+				continue
 
-		#copy assets (skip if this is not the top level of the recursive build)
-		if views == self.views:
-			try:
-				assets_folder = os.path.join(self.environment_src, self.settings["environment"]["assets"])
-				for f in os.listdir(assets_folder):
-					if os.path.isdir(os.path.join(assets_folder, f)):
-						shutil.copytree(os.path.join(assets_folder, f), os.path.join(out, f))
-					else:
-						shutil.copy(os.path.join(assets_folder, f), out)
-			except OSError:
-				print("Could not copy assets")
+			if not os.path.exists(view_out):
+				os.makedirs(view_out)
 
-			#reset g
-			self.g = {}
+			pending.append((view, view_out))
 
-		tmp_fname  = os.path.join(self.environment_src, "templates", "_tmp.html")
+		md = self._markdown()
 
-		#create the html pages
-		for view in views:
+		for (view, view_out), batch_context in zip(pending, self._batch_contexts(pending)):
+			self._build_view(view, view_out, md, batch_context)
+			rebuilt = True
 
-			#if there are subviews, we should build those instead
-			if view.get("subviews"):
-				new_out = os.path.join(out, view["route"])
-				self._build(out=new_out, views=view["subviews"])
-				continue
+		if db_changed:
+			for fname in paginated:
+				if os.path.exists(fname):
+					os.remove(fname)
+					_remove_empty_dirs(os.path.dirname(fname), out)
+					rebuilt = True
 
-			#else, build the page for this view
+		self._close_db_session()
 
-			# create context dict
-			context = dict(
-				[(k, globals()["__builtins__"][k]) for k in self.settings["templates"]["builtins"]],
-				full_route=view["full_route"],
-				route=view["route"],
-			)
-			context.update(**view.get("context", {}))
-
-			# query the database
-			context["query"] = self.query_db(view.get("query"))
-
-			#determine the markdown pages to use for this view
-
-			page_fnames = view.get("pages")
-			if page_fnames == None:
-				page_fnames = ["".join(view["full_route"].lstrip("/").split(".")[:-1]) + ".md"]
-			if page_fnames:
-				page_fnames = [os.path.join(
-					self.environment_src,
-					self.settings["environment"]["pages"],
-					fname
-				) for fname in _collection(page_fnames)]
-			else:
-				page_fnames = []
+		return rebuilt
 
-			#load the context processor
-			#syntax: "module.submodule:callable"
-			context_processor_name = view.get("context_processor")
-			if context_processor_name:
-				try:
-					# module_name, variable_name = context_processor_name.split(":")
-					module, context_processor = _eval_module_and_object(context_processor_name)
-				except ValueError:
-					raise ValueError("incorrect syntax for 'context_processor'")
+	def build(self, out="", user_settings_file="", incremental=False, force=False, jobs=1, refresh_db=False):
+		"""
+		build the site
 
-			else:
-				context_processor = None
+		parameters:
+			out="": output directory (defaults to the project's distribute folder)
+			user_settings_file="": user settings file to use instead of the default one
+			incremental=False: only rebuild outputs whose inputs changed since the last
+				incremental build, and delete outputs whose views no longer exist
+			force=False: ignore the manifest of the last incremental build
+			jobs=1: number of processes used to render pages (0 uses one per CPU).
+				when rendering in parallel, each page's context processor starts
+				with an empty g table, and the tables are merged in view order
+				afterwards (lists are concatenated, mappings are updated, and
+				other values are replaced)
+			refresh_db=False: query the database again instead of using the
+				query snapshots saved by earlier builds
+		"""
 
-			with codecs.open(os.path.join(out, view["route"]), mode="w", encoding="utf-8") as out_file:
-				try:
-					blocks = BlockTable(view["template"])
-					blocks_as_context_vars = {}
-
-					for page_fname in page_fnames:
-						# with open(page_fname, "r") as page_file:
-						with codecs.open(page_fname, mode="r", encoding="utf-8") as page_file:
-							html = md.convert(six.text_type(page_file.read()))
-							html = html.replace("%", "&#37;").replace("{", "&#123;").replace("}", "&#125;")
-							meta = {}
-							special = {"__store_as__": "block"}
-
-							for k, v in getattr(md, "Meta", {}).items():
-								# double-underscore vars are special vars used by gansa
-								if k in ("__block__", "__store_as__"):
-									d = special
-								else:
-									d = meta
-
-								# v will always be a list, which is probably not what users want
-								# if only one item is specified
-								if len(v) == 1:
-									d[k] = v[0]
-								else:
-									d[k] = v
-
-							context.update(meta)
-
-							block_name = special.get("__block__", self.settings["templates"]["default_block"])
-							if special["__store_as__"] == "var":
-								blocks_as_context_vars[block_name] =\
-									blocks_as_context_vars.get(block_name, "") + html
-							elif special["__store_as__"] == "block":
-								blocks.add(block_name, html)
-
-					context.update(blocks_as_context_vars)
-
-					with codecs.open(tmp_fname, mode="w", encoding="utf-8") as tmp:
-						tmp.write(blocks.to_template())
-
-					template = self.templates.get_template("_tmp.html")
-				# if no markdown page was found, just write context variables to the template
-				except OSError:
-					template = self.templates.get_template(view["template"])
+		return self._build(out, user_settings_file=user_settings_file, incremental=incremental, force=force, jobs=jobs, refresh_db=refresh_db)
 
-				if context_processor:
-					new_context = context_processor(context, dict(view), self)
-					if new_context != None:
-						context = new_context
+	def _build(self, out="", views=None, user_settings_file="", incremental=False, force=False, jobs=1, refresh_db=False):
 
+		out = out or self.environment_dist
+		if os.path.abspath(self.environment_src) in os.path.abspath(out):
+			raise OSError("Cannot build site in source directory")
+
+		if not os.path.exists(self.environment_src):
+			raise OSError("Cannot find source directory")
+
+		views = views or self.views
+		self.stats.clear()
+		self._load_page_cache()
+		self._query_results = {}
+		self._callables = {}
+		self.pages.refresh()
+		self._page_index_routes = set()
+
+		if user_settings_file:
+			self.load_user_settings(user_settings_file)
+			with self.profiler.phase("load db"):
+				self.load_db()
+
+		self._load_query_snapshots(refresh_db)
+
+		manifest = None
+		clean = views is self.views
+
+		if incremental:
+			manifest = BuildManifest(
+				os.path.join(self.environment_cache, "manifest.json"),
+				key=_hash_object([os.path.abspath(out), self.settings, self.user_settings])
+			)
+			key = manifest.key
+			if not force and manifest.load() and manifest.key == key and os.path.exists(out):
+				clean = False
+			else:
+				manifest.key = key
+				manifest.outputs = {}
+
+		# the output folder is kept, so that identical outputs are left untouched
+		# (and a server can keep serving from it). the files in it that are not
+		# part of a full build are deleted afterwards
+		if not os.path.exists(out):
+			os.mkdir(out)
+
+		outputs = {}
+		assets_thread = None
+		assets_errors = []
+
+		#copy assets (skip if this is not the top level of the build)
+		if views is self.views:
+			# pages need the fingerprinted names of the assets before they are rendered
+			with self.profiler.phase("fingerprint assets"):
+				self._fingerprint_assets()
+
+			if self.asset_map:
+				manifest_fname = self.settings["assets"]["manifest"]
+				with OutputFile(os.path.join(out, manifest_fname)) as stream:
+					stream.write(six.text_type(json.dumps(self.asset_map, indent=1, sort_keys=True)))
+				outputs[manifest_fname] = None
+
+			def copy_assets():
+				# a project without an assets folder has no assets to copy
+				if not os.path.isdir(os.path.join(self.environment_src, self.settings["environment"]["assets"])):
+					print("Could not copy assets")
+					return
+
+				# errors are kept for the main thread, which raises them once the
+				# copy has finished
 				try:
-					stream = template.render(**context)
-				except TypeError:
-					raise TypeError("context processor must return dict or other mapping")
+					with self.profiler.phase("copy assets"):
+						self._copy_assets(out, outputs)
+				except BaseException:
+					assets_errors.append(sys.exc_info())
+
+			# assets can be copied while the pages are rendered
+			if self.settings["assets"]["background"]:
+				assets_thread = threading.Thread(target=copy_assets)
+				assets_thread.daemon = True
+				assets_thread.start()
+			else:
+				copy_assets()
+
+			#reset g
+			self.g = {}
+
+		def wait_for_assets():
+			if assets_thread:
+				assets_thread.join()
+			if assets_errors and not issubclass(assets_errors[0][0], OSError):
+				six.reraise(*assets_errors[0])
+
+		if assets_thread == None:
+			wait_for_assets()
+
+		self._dependency_cache = {}
 
-				out_file.write(stream)
-		if views == self.views:
+		# forget templates compiled during previous builds
+		if self.templates.cache != None:
+			self.templates.cache.clear()
+
+		#determine which html pages need to be created
+		pending = []
+		for view, view_out in self._leaf_views(views, out):
+			fname = os.path.relpath(os.path.join(view_out, view["route"]), out)
+			outputs[fname] = None
+
+			if manifest:
+				record = self._view_dependencies(view)
+				previous = manifest.outputs.get(fname)
+				if record != None and previous and "page index" in previous:
+					record["page index"] = self.pages.fingerprint()
+				outputs[fname] = record
+
+				if manifest.is_current(fname, record) and os.path.exists(os.path.join(out, fname)):
+					self.stats["pages unchanged"] += 1
+					continue
+
+			if not os.path.exists(view_out):
+				os.makedirs(view_out)
+
+			pending.append((view, view_out))
+
+		# context processor batches are called once for each group of sibling views
+		pending = [
+			(view, view_out, batch_context)
+			for (view, view_out), batch_context in zip(pending, self._batch_contexts(pending))
+		]
+
+		#create the html pages
+		if jobs != 1 and len(pending) > 1:
+			import multiprocessing
+			jobs = jobs or multiprocessing.cpu_count()
+
+		if jobs > 1 and len(pending) > 1:
+			# the pool is not forked while another thread is running
+			wait_for_assets()
+
+			pool = multiprocessing.Pool(
+				min(jobs, len(pending)),
+				initializer=_init_worker,
+				initargs=(self.environment, self.settings, self.user_settings, self.views, self.asset_map, self.pages, self.profiler.enabled)
+			)
 			try:
-				os.remove(tmp_fname)
-			except OSError:
-				pass
+				chunksize = max(1, len(pending) // (jobs * 4))
+				for g, stats, events, page_index_routes in pool.imap(_build_view_in_worker, pending, chunksize):
+					_merge_g(self.g, g)
+					self.stats.update(stats)
+					self.profiler.events.extend(events)
+					self._page_index_routes.update(page_index_routes)
+			finally:
+				pool.terminate()
+				pool.join()
+		else:
+			md = self._markdown()
+			for view, view_out, batch_context in pending:
+				self._build_view(view, view_out, md, batch_context)
+
+		wait_for_assets()
+
+		if assets_errors:
+			print("Could not copy assets")
+
+		if manifest:
+			# pages that used the page index are rendered again when it changes
+			for view, view_out, _ in pending:
+				fname = os.path.relpath(os.path.join(view_out, view["route"]), out)
+				if view["full_route"] in self._page_index_routes and outputs[fname] != None:
+					outputs[fname]["page index"] = self.pages.fingerprint()
+
+		if assets_errors:
+			# the outputs of this build are not all known, so nothing is deleted
+			if manifest:
+				for fname, record in manifest.outputs.items():
+					outputs.setdefault(fname, record)
+		elif clean:
+			# delete everything that was not copied or rendered by this build
+			for dirpath, dirnames, filenames in os.walk(out, topdown=False):
+				for f in filenames:
+					if os.path.relpath(os.path.join(dirpath, f), out) not in outputs:
+						os.remove(os.path.join(dirpath, f))
+				if dirpath != out and not os.listdir(dirpath):
+					os.rmdir(dirpath)
+		elif manifest:
+			# delete outputs whose views or assets no longer exist
+			for fname in set(manifest.outputs) - set(outputs):
+				try:
+					os.remove(os.path.join(out, fname))
+				except OSError:
+					pass
+				_remove_empty_dirs(os.path.dirname(os.path.join(out, fname)), out)
+
+		if manifest:
+			manifest.outputs = outputs
+			manifest.save()
+
+		if views is self.views and self.settings["callbacks"].get("postrender"):
+			_, callback = self._resolve_callable(self.settings["callbacks"]["postrender"], "postrender")
+			with self.profiler.phase("postrender"):
+				callback(self, {"views":views, "out":out})
+
+		if views is self.views:
+			self._close_db_session()
+
+	def summary(self):
+		""" return a short report on the last build """
+
+		lines = ["{0} pages rendered ({1} identical to the existing output), {2} unchanged".format(
+			self.stats["pages rendered"], self.stats["pages identical"], self.stats["pages unchanged"]
+		)]
+		lines.append("{0} assets copied, {1} unchanged".format(self.stats["assets copied"], self.stats["assets unchanged"]))
+
+		misses = self.stats["template cache misses"]
+		lines.append("template cache: {0} hits, {1} misses".format(self.stats["template lookups"] - misses, misses))
+
+		lines.append("markdown cache: {0} hits, {1} misses".format(
+			self.stats["markdown cache hits"], self.stats["markdown cache misses"]
+		))
+
+		if self.db:
+			lines.append("query plans: {0} hits, {1} misses".format(
+				self.stats["query plan hits"], self.stats["query plan misses"]
+			))
+			lines.append("query results: {0} hits, {1} misses".format(
+				self.stats["query result hits"], self.stats["query result misses"]
+			))
+
+		if self.query_snapshots:
+			lines.append("query snapshots: {0} hits, {1} misses".format(
+				self.stats["query snapshot hits"], self.stats["query snapshot misses"]
+			))
+
+		if self.settings["templates"].get("bytecode_cache"):
+			lines.append("bytecode cache: {0} hits, {1} misses".format(
+				self.stats["bytecode cache hits"], self.stats["bytecode cache misses"]
+			))
+
+		return "\n".join(lines)
+
+	def _resolve_callable(self, name, setting):
+		"""
+		return the module and object named by name ("module.submodule:object"),
+		which is resolved once per build. setting is the name of the setting it
+		came from, for error messages
+		"""
 
-		if views == self.views and self.settings["callbacks"].get("postrender"):
+		resolved = self._callables.get(name)
+		if resolved == None:
 			try:
-				_, callback = _eval_module_and_object(self.settings["callbacks"]["postrender"])
+				resolved = _eval_module_and_object(name)
 			except ValueError:
-				raise ValueError("incorrect syntax for 'postrender'")
-			callback(self, {"views":views, "out":out})
+				raise ValueError("incorrect syntax for '{0}'".format(setting))
+			self._callables[name] = resolved
+
+		return resolved
+
+	def _batch_contexts(self, views):
+		"""
+		call the context processor batch of each group of sibling views, and
+		return the extra context of each view (or None), in the order of views
+
+		views is a list of (view, folder) pairs. siblings are the views written to
+		the same folder that have the same context_processor_batch. it is called
+		with the list of siblings and the site, and returns a list with a mapping
+		for each view, or a mapping from the routes of the views to their
+		mappings. a view's mapping is added to its context before its context
+		processor is called.
+
+		when rendering in parallel, the batch is called in the main process, and
+		its results must be picklable.
+		"""
+
+		contexts = [None] * len(views)
+		groups = collections.OrderedDict()
+
+		for i, (view, out) in enumerate(views):
+			name = view.get("context_processor_batch")
+			if name:
+				groups.setdefault((out, name), []).append(i)
+
+		for (out, name), indices in groups.items():
+			_, batch = self._resolve_callable(name, "context_processor_batch")
+			siblings = [dict(views[i][0]) for i in indices]
+
+			reads = self.pages.reads
+			with self.profiler.phase("context processor batch"):
+				result = batch(siblings, self)
+			if self.pages.reads != reads:
+				self._page_index_routes.update(view["full_route"] for view in siblings)
+
+			if result == None:
+				continue
+			if isinstance(result, Mapping):
+				result = [result.get(view["route"]) for view in siblings]
+			else:
+				result = list(result)
+				if len(result) != len(siblings):
+					raise ValueError("context processor batch must return one context for each view")
+
+			for i, context in zip(indices, result):
+				contexts[i] = context
+
+		return contexts
+
+	def _leaf_views(self, views, out):
+		""" yield each view that has no subviews, along with the folder its page is written to """
+
+		if views is self.views:
+			for route in self.route_table:
+				view_out = os.path.join(out, route.folder) if route.folder else out
+				for v in self._expand_view(route.view):
+					yield v, view_out
+			return
+
+		for view in views:
+			if view.get("subviews"):
+				for leaf in self._leaf_views(view["subviews"], os.path.join(out, view["route"])):
+					yield leaf
+			else:
+				for v in self._expand_view(view):
+					yield v, out
+
+	def _paginated_outputs(self, out):
+		""" return the files that the pages of paginated views are written to """
+
+		return set(
+			os.path.join(view_out, view["route"])
+			for view, view_out in self._leaf_views(self.views, out)
+			if "page" in view
+		)
+
+	def _expand_view(self, view):
+		"""
+		return the views that a paginated view expands into, or [view] for any
+		other view
+
+		a paginated view has a route pattern, a query, and a 'paginate' mapping.
+		with 'per_page', the query result is split into pages of that many rows,
+		and {n} in the route is replaced by the page number. with 'key', there is
+		one page for each value of that column, and {<key>} in the route is
+		replaced by the value, with path separators replaced by '-'. rows whose
+		value is None or empty get no page. the query of each page is its share
+		of the rows.
+		"""
+
+		paginate = view.get("paginate")
+		if not paginate:
+			return [view]
+
+		rows = self._query_rows(view.get("query"))
+		key = paginate.get("key")
+
+		if key:
+			groups = collections.OrderedDict()
+			for i, row in enumerate(rows):
+				value = _row_value(row, key)
+				if value != None and value != "":
+					groups.setdefault(value, []).append(i)
+			pages = list(groups.items())
+		else:
+			per_page = int(paginate.get("per_page", 10))
+			if per_page < 1:
+				raise ValueError("'per_page' must be at least 1")
+			# an empty result still gets a (blank) first page
+			pages = [(None, list(range(i, min(i + per_page, len(rows))))) for i in range(0, len(rows) or 1, per_page)]
+
+		prefix = view["full_route"][:len(view["full_route"]) - len(view["route"])]
+		routes = [
+			view["route"].format(**dict({"n": n + 1}, **({key: _route_value(value)} if key else {})))
+			for n, (value, _) in enumerate(pages)
+		]
+
+		if len(set(routes)) != len(routes):
+			raise ValueError("pages of {0} have the same route".format(view["full_route"]))
+
+		views = []
+		for n, (value, row_ids) in enumerate(pages):
+			v = dict((k, v) for k, v in view.items() if k != "paginate")
+			v["route"] = routes[n]
+			v["full_route"] = prefix + routes[n]
+			if v.get("pages") == None:
+				v["pages"] = []
+			v["page"] = {
+				"number": n + 1,
+				"count": len(pages),
+				"key": value,
+				"previous": prefix + routes[n - 1] if n > 0 else None,
+				"next": prefix + routes[n + 1] if n + 1 < len(pages) else None
+			}
+			v["query_rows"] = row_ids
+			views.append(v)
+
+		return views
+
+	def _copy_assets(self, out, outputs=None):
+		"""
+		copy the assets folder into out
+
+		files that already have an up-to-date copy in out are skipped (see
+		gansa.assets.is_current), and a record of each file is added to outputs
+		"""
+
+		assets_folder = os.path.join(self.environment_src, self.settings["environment"]["assets"])
+		if not os.path.isdir(assets_folder):
+			raise OSError("Cannot find assets folder")
+
+		copier = AssetCopier(self.settings["assets"]["link"])
+		use_hash = self.settings["assets"]["hash"]
+
+		for dirpath, dirnames, filenames in os.walk(assets_folder):
+			for f in filenames:
+				src = os.path.join(dirpath, f)
+				fname = os.path.relpath(src, assets_folder)
+				fname = self.asset_map.get(fname.replace(os.sep, "/"), fname).replace("/", os.sep)
+				dst = os.path.join(out, fname)
+
+				st = os.stat(src)
+				if outputs is not None:
+					outputs[fname] = {"asset": [st.st_size, st.st_mtime]}
+
+				if is_current(src, dst, st, use_hash):
+					self.stats["assets unchanged"] += 1
+					continue
+
+				copier.copy(src, dst)
+				self.stats["assets copied"] += 1
+
+	def _fingerprint_assets(self):
+		"""
+		map the assets that are fingerprinted to their names in the output (see
+		gansa.assets.fingerprint). the hash of each asset is only computed again
+		when the asset changes.
+		"""
+
+		self.asset_map = {}
+
+		patterns = self.settings["assets"]["fingerprint"]
+		assets_folder = os.path.join(self.environment_src, self.settings["environment"]["assets"])
+		if not patterns or not os.path.isdir(assets_folder):
+			return
+
+		hashes = AssetHashes(os.path.join(self.environment_cache, "assets.json"))
+
+		for dirpath, dirnames, filenames in os.walk(assets_folder):
+			for f in filenames:
+				src = os.path.join(dirpath, f)
+				fname = os.path.relpath(src, assets_folder).replace(os.sep, "/")
+				if should_fingerprint(fname, patterns):
+					self.asset_map[fname] = fingerprint(fname, hashes.get(src))
+
+		hashes.save()
+
+	def asset_url(self, name):
+		"""
+		return the url of an asset, given its path in the assets folder
+
+		available to templates as asset_url
+		"""
+
+		name = name.lstrip("/")
+		return self.settings["assets"]["url"] + self.asset_map.get(name, name)
+
+	def _view_page_fnames(self, view):
+		""" return the full paths of the markdown pages used by a view """
+
+		page_fnames = view.get("pages")
+		if page_fnames == None:
+			page_fnames = ["".join(view["full_route"].lstrip("/").split(".")[:-1]) + ".md"]
+		if page_fnames:
+			return [os.path.join(
+				self.environment_src,
+				self.settings["environment"]["pages"],
+				fname
+			) for fname in _collection(page_fnames)]
+		else:
+			return []
+
+	def _view_dependencies(self, view):
+		"""
+		return a record of everything the output of a view depends on, or None if
+		the output cannot be reused (e.g. the view reads from a database server)
+		"""
+
+		cache = self._dependency_cache
+
+		if "db" not in cache:
+			cache["db"] = self._db_fingerprint()
+			cache["assets"] = _hash_object(self.asset_map) if self.asset_map else None
+
+		pages = {}
+		for fname in self._view_page_fnames(view):
+			try:
+				pages[os.path.relpath(fname, self.environment_src)] = hash_file(fname)
+			except (IOError, OSError):
+				pages[os.path.relpath(fname, self.environment_src)] = None
+
+		templates = self._template_dependencies(view["template"])
+		if templates == None:
+			return None
+
+		callbacks = {}
+		for setting in ("context_processor", "context_processor_batch"):
+			name = view.get(setting) or ""
+			if name:
+				if name not in cache:
+					module, _ = self._resolve_callable(name, setting)
+					module_fname = getattr(module, "__file__", None)
+					if module_fname and module_fname.endswith((".pyc", ".pyo")):
+						module_fname = module_fname[:-1]
+					try:
+						cache[name] = name + "@" + hash_file(module_fname)
+					except (IOError, OSError, TypeError):
+						cache[name] = None
+				name = cache[name]
+				if name == None:
+					return None
+			callbacks[setting] = name
+
+		query = None
+		if self.db:
+			# context processors are free to read from the database too
+			if cache["db"] == None and (view.get("query") or any(callbacks.values())):
+				return None
+			query = [_hash_object(view.get("query")), cache["db"]]
+
+		return {
+			"pages": pages,
+			"templates": templates,
+			"view": _hash_object(dict((k, v) for k, v in view.items() if k != "subviews")),
+			"context_processor": callbacks["context_processor"],
+			"context_processor_batch": callbacks["context_processor_batch"],
+			"query": query,
+			"assets": cache["assets"]
+		}
+
+	def _template_dependencies(self, name, deps=None):
+		"""
+		return a dict mapping a template and every template it extends, includes
+		or imports to a hash of its source, or None if any of them cannot be
+		determined before rendering
+		"""
+
+		cache = self._dependency_cache.setdefault("templates", {})
+		if deps == None and name in cache:
+			return cache[name]
+
+		top_level = deps == None
+		deps = {} if top_level else deps
+
+		try:
+			source, _, _ = self.templates.loader.get_source(self.templates, name)
+		except jinja2.TemplateNotFound:
+			return None
+
+		deps[name] = _hash_bytes(source.encode("utf-8"))
+
+		for ref in jinja2.meta.find_referenced_templates(self.templates.parse(source)):
+			if ref == None:
+				deps = None
+				break
+			elif ref not in deps and self._template_dependencies(ref, deps) == None:
+				deps = None
+				break
+
+		if top_level:
+			cache[name] = deps
+
+		return deps
+
+	def _db_fnames(self):
+		""" return the files the database is stored in, or an empty list for database servers """
+
+		db_engine = self.user_settings["database"].get("engine")
+
+		if db_engine in ("yaml", "json", "msgpack", "csv"):
+			return [os.path.join(self.environment_src, f) for f in _collection(self.user_settings["database"]["uri"])]
+		elif db_engine == "sqlite":
+			p = self.user_settings["database"]["uri"].split("sqlite:///")[-1]
+			if p and p != ":memory:":
+				return [os.path.join(self.environment_src, p)]
+
+		return []
+
+	def _db_fingerprint(self):
+		""" return a fingerprint of the database, or None if it cannot be determined cheaply """
+
+		if not self.user_settings["database"].get("engine"):
+			return ""
+
+		fnames = self._db_fnames()
+		if not fnames:
+			# a database server has only changed if its change-detection query says so
+			check = self.query_snapshots and self._snapshot_check()
+			return ["check", check] if check else None
+
+		fingerprint = []
+		for fname in fnames:
+			try:
+				st = os.stat(fname)
+			except OSError:
+				return None
+			fingerprint.append([fname, st.st_size, st.st_mtime])
+
+		return fingerprint
+
+	def _scan_pages(self):
+		"""
+		return an entry for each markdown page for the page index, reading only
+		the metadata header of each page
+		"""
+
+		folder = os.path.join(self.environment_src, self.settings["environment"]["pages"])
+
+		routes = {}
+		for route in self.route_table:
+			if not route.view.get("paginate"):
+				for fname in self._view_page_fnames(route.view):
+					routes.setdefault(os.path.abspath(fname), route.view["full_route"])
+
+		fnames = []
+		for dirpath, dirnames, filenames in os.walk(folder):
+			fnames.extend(os.path.join(dirpath, f) for f in filenames if f.endswith(".md"))
+
+		pages = []
+		with self.profiler.phase("scan pages"):
+			for fname in sorted(fnames):
+				meta = {}
+				for k, v in read_meta(fname).items():
+					if not k.startswith("__"):
+						meta[k] = v[0] if len(v) == 1 else v
+
+				pages.append({
+					"name": os.path.relpath(fname, folder).replace(os.sep, "/"),
+					"route": routes.get(os.path.abspath(fname)),
+					"mtime": os.path.getmtime(fname),
+					"meta": meta
+				})
+
+		return pages
+
+	def _markdown(self):
+
+		return markdown.Markdown(
+			extensions = [MetaExtension()] + self.settings["pages"]["extensions"],
+			extension_configs = self.settings["pages"]["extension_options"]
+		)
+
+	def _convert_page(self, md, fname):
+		""" return the html and metadata of a markdown page, using the page cache when possible """
+
+		with open(fname, "rb") as page_file:
+			source = page_file.read()
+
+		key = _hash_bytes(source)
+		page = self.page_cache.get(key)
+
+		if page != None:
+			self.stats["markdown cache hits"] += 1
+		else:
+			self.stats["markdown cache misses"] += 1
+			md.reset()
+			html = md.convert(source.decode("utf-8"))
+			page = (html, dict(getattr(md, "Meta", {})))
+			self.page_cache.set(key, page)
+
+		return page
+
+	def _load_page_cache(self):
+
+		if self.settings["pages"].get("cache"):
+			folder = os.path.join(self.environment_cache, "pages")
+		else:
+			folder = None
+
+		# converted pages depend on the markdown extensions as well as the page itself
+		self.page_cache = PageCache(folder, version=_hash_object([
+			getattr(markdown, "version", None) or getattr(markdown, "__version__", ""),
+			self.settings["pages"]["extensions"],
+			self.settings["pages"]["extension_options"]
+		]))
+
+	def _build_view(self, view, out, md, batch_context=None):
+		"""
+		render the page for a single view into the folder out. batch_context is
+		the view's share of its context_processor_batch result, if any
+		"""
+
+		with self.profiler.phase("view", view["full_route"]):
+			self._render_view(view, out, md, batch_context)
+
+	def _render_view(self, view, out, md, batch_context=None):
+
+		self.stats["pages rendered"] += 1
+		route = view["full_route"]
+		page_index_reads = self.pages.reads
+
+		# create context dict
+		context = dict(
+			[(k, globals()["__builtins__"][k]) for k in self.settings["templates"]["builtins"]],
+			full_route=view["full_route"],
+			route=view["route"],
+		)
+		context.update(**view.get("context", {}))
+
+		# query the database
+		with self.profiler.phase("query", route):
+			if "query_rows" in view:
+				# a page of a paginated view only gets its share of the rows
+				rows = self._query_rows(view.get("query"))
+				context["query"] = [rows[i] for i in view["query_rows"]]
+				context["page"] = view["page"]
+			else:
+				context["query"] = self.query_db(view.get("query"))
+
+		#determine the markdown pages to use for this view
+		page_fnames = self._view_page_fnames(view)
+
+		#load the context processor
+		#syntax: "module.submodule:callable"
+		context_processor_name = view.get("context_processor")
+		if context_processor_name:
+			module, context_processor = self._resolve_callable(context_processor_name, "context_processor")
+		else:
+			context_processor = None
+
+		with OutputFile(os.path.join(out, view["route"])) as out_file:
+			try:
+				blocks = BlockTable(view["template"])
+				blocks_as_context_vars = {}
+
+				for page_fname in page_fnames:
+					with self.profiler.phase("markdown", route):
+						html, page_meta = self._convert_page(md, page_fname)
+					html = html.replace("%", "&#37;").replace("{", "&#123;").replace("}", "&#125;")
+					meta = {}
+					special = {"__store_as__": "block"}
+
+					for k, v in page_meta.items():
+						# double-underscore vars are special vars used by gansa
+						if k in ("__block__", "__store_as__"):
+							d = special
+						else:
+							d = meta
+
+						# v will always be a list, which is probably not what users want
+						# if only one item is specified
+						if len(v) == 1:
+							d[k] = v[0]
+						else:
+							d[k] = v
+
+					context.update(meta)
+
+					block_name = special.get("__block__", self.settings["templates"]["default_block"])
+					if special["__store_as__"] == "var":
+						blocks_as_context_vars[block_name] =\
+							blocks_as_context_vars.get(block_name, "") + html
+					elif special["__store_as__"] == "block":
+						blocks.add(block_name, html)
+
+				context.update(blocks_as_context_vars)
+
+				# the page template only lives in memory; its parent is loaded
+				# through the environment's cache
+				with self.profiler.phase("template", route):
+					template = self.templates.from_string(blocks.to_template())
+			# if no markdown page was found, just write context variables to the template
+			except OSError:
+				with self.profiler.phase("template", route):
+					template = self.templates.get_template(view["template"])
+
+			if batch_context:
+				context.update(batch_context)
+
+			if context_processor:
+				with self.profiler.phase("context processor", route):
+					new_context = context_processor(context, dict(view), self)
+				if new_context != None:
+					context = new_context
+
+			with self.profiler.phase("render", route):
+				try:
+					if self.settings["templates"]["stream"]:
+						# only a few chunks of the page are held in memory at a time
+						stream = template.stream(**context)
+						stream.enable_buffering(STREAM_BUFFER_SIZE)
+					else:
+						stream = template.render(**context)
+				except TypeError:
+					raise TypeError("context processor must return dict or other mapping")
+
+				if isinstance(stream, six.string_types):
+					out_file.write(stream)
+				else:
+					stream.dump(out_file)
+
+		if not out_file.changed:
+			self.stats["pages identical"] += 1
+
+		if self.pages.reads != page_index_reads:
+			self._page_index_routes.add(route)
+
+	def _close_db_session(self):
+		""" close the sql session, returning its connection to the pool """
+
+		# sqlalchemy is only imported if the site uses a sql database
+		orm = sys.modules.get("sqlalchemy.orm")
+		if orm and isinstance(self.db, orm.scoped_session):
+			self.db.remove()
 
 	def query_db(self, query=None):
+		"""
+		query the database
+
+		within a build, identical queries are only run once (see _build); the
+		result is shared by every view that asks for it
+		"""
 
 		if not self.db:
 			return
 
 		method = {
 			"yaml": self._query_yaml,
+			"json": self._query_yaml,
+			"msgpack": self._query_yaml,
 			"sqlite": self._query_sqlite,
 			"postgresql": self._query_postgresql,
 			"mysql": self._query_mysql,
@@ -580,19 +2116,166 @@ class Site(object):
 			"mongodb": self._query_mongodb
 		}[self.user_settings["database"]["engine"]]
 
+		key = _query_key(query)
+
+		if key in self._query_results:
+			self.stats["query result hits"] += 1
+			r = self._query_results[key]
+		else:
+			self.stats["query result misses"] += 1
+			r = self._query_results[key] = self._query_snapshot(method, query)
+
+		# views get their own list, so that context processors can modify it freely
+		if isinstance(r, list):
+			r = list(r)
+
+		return r
+
+	def _query_snapshot(self, method, query):
+		""" run a query with method, or return its result from a snapshot (see QuerySnapshots) """
+
+		snapshots = self.query_snapshots
+		if snapshots == None or not query:
+			return method(query)
+
+		key = _query_key(query)
+		check = self._snapshot_check()
+		snapshot = snapshots.get(key, check)
+
+		if snapshot != None:
+			self.stats["query snapshot hits"] += 1
+			return self._attach_snapshot(snapshot["result"])
+
+		self.stats["query snapshot misses"] += 1
+
 		r = method(query)
+		# lazy results are fetched now, so that they can be stored
+		if isinstance(r, StreamedQuery):
+			r = r.all()
+		elif not isinstance(r, (list, dict) + six.string_types) and hasattr(r, "__iter__"):
+			r = list(r)
+
+		snapshots.set(key, r, check)
+
 		return r
 
+	def _attach_snapshot(self, result):
+		"""
+		add the sqlalchemy model instances in a snapshot to the session, so that
+		their lazy relationships can still be loaded. rows holding several
+		instances are returned as named tuples.
+		"""
+
+		# sqlalchemy is only imported if the site uses a sql database
+		orm = sys.modules.get("sqlalchemy.orm")
+		if not orm or not isinstance(self.db, orm.scoped_session) or not isinstance(result, list):
+			return result
+
+		import sqlalchemy
+
+		def attach(o):
+			state = sqlalchemy.inspect(o, raiseerr=False)
+			if isinstance(state, orm.state.InstanceState):
+				# load=False trusts the snapshot instead of querying every instance again
+				return self.db.merge(o, load=False)
+			return o
+
+		row_types = {}
+		attached = []
+
+		for item in result:
+			fields = getattr(item, "_fields", None)
+			if fields == None:
+				attached.append(attach(item))
+				continue
+
+			values = [attach(v) for v in item]
+			if all(a is b for a, b in zip(values, item)):
+				attached.append(item)
+				continue
+
+			fields = tuple(fields)
+			if fields not in row_types:
+				row_types[fields] = collections.namedtuple("Row", fields, rename=True)
+			attached.append(row_types[fields](*values))
+
+		return attached
+
+	def _snapshot_check(self):
+		""" return a hash of the result of the change-detection query, running it once per build """
+
+		settings = self.user_settings["database"].get("snapshots")
+		check = settings.get("check") if isinstance(settings, dict) else None
+		if not check:
+			return None
+
+		if ("snapshot check",) not in self._query_results:
+			method = getattr(self, "_query_" + self.user_settings["database"]["engine"])
+			result = method(check)
+			if not isinstance(result, (list, dict) + six.string_types) and hasattr(result, "__iter__"):
+				result = list(result)
+			self._query_results[("snapshot check",)] = _hash_object(result)
+
+		return self._query_results[("snapshot check",)]
+
+	def _load_query_snapshots(self, refresh=False):
+		"""
+		set up the snapshot cache for sql and mongodb queries, if user.yaml
+		asks for one. if refresh is True, the existing snapshots are deleted.
+		"""
+
+		database = self.user_settings["database"]
+		settings = database.get("snapshots")
+
+		if not settings or database.get("engine") not in ("sqlite", "postgresql", "mysql", "mongodb"):
+			self.query_snapshots = None
+			return
+
+		self.query_snapshots = QuerySnapshots(
+			os.path.join(self.environment_cache, "queries"),
+			version=_hash_object([database["engine"], database["uri"]]),
+			ttl=settings.get("ttl") if isinstance(settings, dict) else None
+		)
+
+		if refresh:
+			self.query_snapshots.clear()
+
+	def _query_rows(self, query):
+		""" return the result of a query as a list, making the list at most once per build """
+
+		key = ("rows", _query_key(query))
+
+		if key not in self._query_results:
+			self._query_results[key] = list(self.query_db(query) or [])
+
+		return self._query_results[key]
+
+	def _query_plan(self, query, compile_query):
+		""" return the compiled form of a query, compiling it only the first time it is seen """
+
+		key = (compile_query.__name__, _query_key(query))
+		plan = self._query_plans.get(key)
+
+		if plan == None:
+			self.stats["query plan misses"] += 1
+			plan = self._query_plans[key] = compile_query(query)
+		else:
+			self.stats["query plan hits"] += 1
+
+		return plan
 
 	def _query_yaml(self, query=None):
 
 		if not query:
 			return self.db
 
-		condition = eval("lambda db: " + query, {})
+		condition = self._query_plan(query, self._compile_yaml_query)
 
 		return condition(self.db)
 
+	def _compile_yaml_query(self, query):
+		return eval("lambda db: " + query, {})
+
 	def _query_sqlite(self, query=None):
 		return self._query_sql(query)
 
@@ -607,10 +2290,7 @@ class Site(object):
 		if not query:
 			return None
 
-		if not query.get("model"):
-			raise KeyError("query must specify database model")
-
-		_, model = _eval_module_and_object(query["model"])
+		model = self._query_plan(query, self._compile_mongodb_query)
 
 		q = model.objects
 
@@ -621,18 +2301,64 @@ class Site(object):
 			order = _collection(query["order"])
 			q = q.order_by(*order)
 
+		# querysets are already fetched lazily, in batches
+		if query.get("offset"):
+			q = q.skip(int(query["offset"]))
+
+		if query.get("limit") != None:
+			q = q.limit(int(query["limit"]))
+
 		return q
 
+	def _compile_mongodb_query(self, query):
+
+		if not query.get("model"):
+			raise KeyError("query must specify database model")
+
+		_, model = _eval_module_and_object(query["model"])
+		return model
+
 	def _query_sql(self, query=None):
 
 		if not query:
 			return self.db
 		elif isinstance(query, six.string_types):
-			return [row for row in self.db_engine.execute(query)]
+			with self.db_engine.connect() as connection:
+				# newer versions of sqlalchemy only run plain sql strings through exec_driver_sql
+				execute = getattr(connection, "exec_driver_sql", connection.execute)
+				return [row for row in execute(query)]
+
+		plan = self._query_plan(query, self._compile_sql_query)
+
+		q = self.db.query(*plan["models"])
+
+		if plan["join"]:
+			q = q.join(*[j() for j in plan["join"]])
+
+		for fil in plan["filter"]:
+			q = q.filter(fil())
+
+		for o in plan["order"]:
+			q = q.order_by(o())
+
+		if query.get("offset"):
+			q = q.offset(int(query["offset"]))
+
+		if query.get("limit") != None:
+			q = q.limit(int(query["limit"]))
+
+		if query.get("stream") or query.get("yield_per"):
+			return StreamedQuery(q, int(query.get("yield_per") or STREAM_YIELD_PER))
+
+		return q.all()
+
+	def _compile_sql_query(self, query):
 
 		if not query.get("models"):
 			raise KeyError("query must specify database models")
 
+		import sqlalchemy
+
 		models_modules = {"sqlalchemy": sqlalchemy}
 		models = []
 		for s in  _collection(query["models"]):
@@ -647,31 +2373,12 @@ class Site(object):
 			except ValueError:
 				raise ValueError("incorrect syntax for 'models'")
 
-		q = self.db.query(*models)
-
-		if query.get("join"):
-			joins = _collection(query["join"])
-			args = []
-
-			for j in joins:
-				args.append(eval("lambda: " + j, models_modules)())
-
-			q = q.join(*args)
-
-		if query.get("filter"):
-			filters = _collection(query["filter"])
-
-			for fil in filters:
-				q = q.filter(eval("lambda: " + fil, models_modules)())
-
-		if query.get("order"):
-			order = _collection(query["order"])
-
-			for o in order:
-				f = eval("lambda: " + o, models_modules)
-				q = q.order_by(f())
-
-		return q.all()
+		return {
+			"models": models,
+			"join": [eval("lambda: " + j, models_modules) for j in _collection(query.get("join") or [])],
+			"filter": [eval("lambda: " + f, models_modules) for f in _collection(query.get("filter") or [])],
+			"order": [eval("lambda: " + o, models_modules) for o in _collection(query.get("order") or [])]
+		}
 
 	def _query_csv(self, query=None):
 
@@ -682,29 +2389,18 @@ class Site(object):
 		if not table:
 			raise KeyError("table {0} not found in database".format(repr(query.get("table"))))
 
-		copy = list(table)
+		conditions, order = self._query_plan(query, self._compile_csv_query)
 
-		if query.get("filter"):
-			# if not isinstance(query["filter"], list):
-			# 	query["filter"] = [query["filter"]]
-			query["filter"] = _collection(query["filter"])
+		return table.select(conditions, order)
 
-			conditions = [eval("lambda row: " + l, {}) for l in query["filter"]]
+	def _compile_csv_query(self, query):
 
-			def filter_key(item):
-				for condition in conditions:
-					if not condition(item):
-						return False
-
-				return True
-
-			copy = filter(filter_key, copy)
+		conditions = []
+		for l in _collection(query.get("filter") or []):
+			conditions.extend(compile_condition(l))
 
+		order = []
 		if query.get("order"):
-			# if not isinstance(query["order"], list):
-			# 	query["order"] = [query["order"]]
-
-			order = []
 			for k in _collection(query["order"]):
 				#normalize the key into a tuple, with "ascending" or "descending" as the second element
 
@@ -712,7 +2408,7 @@ class Site(object):
 					_o = k.split(" ")
 
 					if len(_o) > 1 and _o[-1] in {"ascending", "descending"}:
-						v = (" ".join(_o[:-1]), o[-1])
+						v = (" ".join(_o[:-1]), _o[-1])
 					else:
 						try:
 							v = (_tonumber(_o[0]), "ascending")
@@ -723,7 +2419,4 @@ class Site(object):
 				else:
 					order.append((k, "ascending"))
 
-			for k in reversed(order):
-				copy.sort(key = (lambda item: item[k[0]]), reverse=(k[1]=="descending"))
-
-		return copy
+		return conditions, order
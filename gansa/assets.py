@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+
+# This file is part of Gansa.
+
+# Gansa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Gansa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Gansa.  If not, see <http://www.gnu.org/licenses/>.
+
+import os, shutil, hashlib, functools, fnmatch, json
+
+from gansa.files import atomic_write
+
+LINK_METHODS = ("copy", "hardlink", "reflink")
+
+# linux ioctl that makes dst share src's blocks on btrfs, xfs and other copy-on-write filesystems
+FICLONE = 0x40049409
+
+def hash_file(fname):
+
+	h = hashlib.sha1()
+
+	with open(fname, "rb") as stream:
+		for chunk in iter(functools.partial(stream.read, 65536), b""):
+			h.update(chunk)
+
+	return h.hexdigest()
+
+def fingerprint(fname, digest, length=10):
+	""" return fname with the start of digest inserted before its extension, e.g. "css/main.0123456789.css" """
+
+	root, ext = os.path.splitext(fname)
+	return "{0}.{1}{2}".format(root, digest[:length], ext)
+
+def should_fingerprint(fname, patterns):
+	"""
+	return True if the asset fname (relative to the assets folder) gets a
+	fingerprinted name. patterns is True for every asset, or a list of glob
+	patterns
+	"""
+
+	if patterns == True:
+		return True
+
+	fname = fname.replace(os.sep, "/")
+	return any(fnmatch.fnmatch(fname, p) for p in patterns or [])
+
+class AssetHashes(object):
+	"""
+	hashes of the contents of the assets, saved between builds
+
+	a hash is reused for as long as its file keeps the same size and
+	modification time
+	"""
+
+	def __init__(self, fname):
+		self.fname = fname
+		self.hashes = {}
+		self.changed = False
+
+		try:
+			with open(fname) as stream:
+				self.hashes = json.load(stream)
+		except (IOError, OSError, ValueError):
+			pass
+
+	def get(self, fname, st=None):
+		""" return the hash of the file fname, whose os.stat result is st """
+
+		st = st or os.stat(fname)
+		record = self.hashes.get(fname)
+
+		if record and record[0] == st.st_size and record[1] == st.st_mtime:
+			return record[2]
+
+		digest = hash_file(fname)
+		self.hashes[fname] = [st.st_size, st.st_mtime, digest]
+		self.changed = True
+
+		return digest
+
+	def save(self):
+
+		if not self.changed:
+			return
+
+		with atomic_write(self.fname, mode="w") as stream:
+			json.dump(self.hashes, stream, sort_keys=True)
+
+		self.changed = False
+
+def is_current(src, dst, st=None, use_hash=False):
+	"""
+	return True if dst is already a copy of src
+
+	files match if their sizes and modification times match (copies keep the
+	modification time of the original), or if use_hash is True and their sizes
+	and contents match. in the last case dst is given src's modification time,
+	so that the next comparison is cheap.
+	"""
+
+	st = st or os.stat(src)
+
+	try:
+		dst_st = os.stat(dst)
+	except OSError:
+		return False
+
+	if dst_st.st_size != st.st_size:
+		return False
+	if dst_st.st_mtime == st.st_mtime:
+		return True
+	if not use_hash or hash_file(src) != hash_file(dst):
+		return False
+
+	os.utime(dst, (st.st_atime, st.st_mtime))
+	return True
+
+def reflink(src, dst):
+	""" make dst a copy-on-write clone of src; raises IOError or OSError where that is not supported """
+
+	import fcntl
+
+	with open(src, "rb") as s:
+		with open(dst, "wb") as d:
+			fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+	shutil.copystat(src, dst)
+
+class AssetCopier(object):
+	"""
+	puts copies of assets into the output folder
+
+	method is "copy", "hardlink" or "reflink". when a file cannot be linked
+	(because it is on another device, or the filesystem cannot clone files),
+	it is copied instead, and so is every file after it.
+	"""
+
+	def __init__(self, method="copy"):
+
+		if method not in LINK_METHODS:
+			raise ValueError("{0} is not a recognized asset link method".format(method))
+
+		self.method = method
+
+	def copy(self, src, dst):
+
+		folder = os.path.dirname(dst)
+		if not os.path.exists(folder):
+			os.makedirs(folder)
+
+		# never write through dst: it may be a hard link to an asset
+		if os.path.lexists(dst):
+			os.remove(dst)
+
+		if self.method == "hardlink":
+			try:
+				return os.link(src, dst)
+			except (AttributeError, OSError):
+				self.method = "copy"
+		elif self.method == "reflink":
+			try:
+				return reflink(src, dst)
+			except (ImportError, IOError, OSError):
+				self.method = "copy"
+				if os.path.exists(dst):
+					os.remove(dst)
+
+		shutil.copy2(src, dst)
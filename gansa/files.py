@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+# This file is part of Gansa.
+
+# Gansa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Gansa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Gansa.  If not, see <http://www.gnu.org/licenses/>.
+
+import os, codecs, contextlib
+
+def make_folder(folder):
+	""" create folder and its parents if they do not exist """
+
+	if folder and not os.path.exists(folder):
+		try:
+			os.makedirs(folder)
+		except OSError:
+			# another process or thread may have created it first
+			if not os.path.isdir(folder):
+				raise
+
+def replace_file(src, dst):
+	""" move src over dst in one step, so that readers never see a partial dst """
+	getattr(os, "replace", os.rename)(src, dst)
+
+def temp_name(fname):
+	""" return the temporary file that fname is written to before it is replaced """
+	return "{0}.{1}.tmp".format(fname, os.getpid())
+
+@contextlib.contextmanager
+def atomic_write(fname, mode="wb", encoding=None):
+	"""
+	open a temporary file, which replaces fname when the with block ends
+
+	if the block raises, the temporary file is deleted and fname is left as it
+	was. the folder of fname is created if needed.
+	"""
+
+	make_folder(os.path.dirname(fname))
+	tmp = temp_name(fname)
+
+	try:
+		with (codecs.open(tmp, mode, encoding) if encoding else open(tmp, mode)) as stream:
+			yield stream
+	except BaseException:
+		os.remove(tmp)
+		raise
+
+	replace_file(tmp, fname)
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+
+# This file is part of Gansa.
+
+# Gansa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Gansa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Gansa.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+import io, re, collections, hashlib, json
+
+# the header syntax of python-markdown's meta extension
+META_RE = re.compile(r"^[ ]{0,3}(?P<key>[A-Za-z0-9_-]+):\s*(?P<value>.*)")
+META_MORE_RE = re.compile(r"^[ ]{4,}(?P<value>.*)")
+BEGIN_RE = re.compile(r"^-{3}(\s.*)?")
+END_RE = re.compile(r"^(-{3}|\.{3})(\s.*)?")
+
+def read_meta(fname):
+	"""
+	return the metadata of a markdown page, reading only its header
+
+	like the meta extension, keys are lowercase and every value is a list of
+	lines. the rest of the page is not read.
+	"""
+
+	meta = {}
+	key = None
+
+	with io.open(fname, encoding="utf-8") as stream:
+		for n, line in enumerate(stream):
+			line = line.rstrip("\r\n")
+			if n == 0 and BEGIN_RE.match(line):
+				continue
+			if not line.strip() or END_RE.match(line):
+				break
+
+			m = META_RE.match(line)
+			if m:
+				key = m.group("key").lower().strip()
+				meta.setdefault(key, []).append(m.group("value").strip())
+				continue
+
+			m = META_MORE_RE.match(line)
+			if m and key:
+				meta[key].append(m.group("value").strip())
+			else:
+				break
+
+	return meta
+
+def _value(page, key):
+	""" return the metadata value key of page, or the page's own field of that name """
+
+	if key in page["meta"]:
+		return page["meta"][key]
+	return page.get(key)
+
+class PageIndex(object):
+	"""
+	the metadata of every markdown page, scanned once per build
+
+	each page is a dict with its name (relative to the pages folder), the full
+	route of the view that renders it (or None), its modification time, and its
+	metadata. as in pages, metadata values with a single line are strings, and
+	double-underscore keys are left out.
+
+	the index is loaded by calling loader the first time it is used. reads
+	counts the lookups made through it, so that the pages that use the index
+	can be found.
+	"""
+
+	def __init__(self, loader=None):
+		self.loader = loader
+		self.reads = 0
+		self.refresh()
+
+	def refresh(self):
+		""" forget the index, so that it is scanned again when it is next used """
+
+		self._pages = None
+		self._names = None
+		self._routes = None
+		self._fingerprint = None
+
+	def _load(self):
+
+		if self._pages == None:
+			self._pages = list(self.loader()) if self.loader else []
+			self._names = dict((page["name"], page) for page in self._pages)
+			self._routes = dict((page["route"], page) for page in self._pages if page["route"])
+
+		return self._pages
+
+	def _read(self):
+		self.reads += 1
+		return self._load()
+
+	@property
+	def pages(self):
+		""" every page, ordered by name """
+		return self._read()
+
+	def __iter__(self):
+		return iter(self.pages)
+
+	def __len__(self):
+		return len(self.pages)
+
+	def __contains__(self, name):
+		self._read()
+		return name in self._names
+
+	def __getitem__(self, name):
+		self._read()
+		return self._names[name]
+
+	def get(self, name, default=None):
+		""" return the page named name (e.g. "posts/first.md") """
+
+		self._read()
+		return self._names.get(name, default)
+
+	def route(self, full_route, default=None):
+		""" return the page rendered at full_route (e.g. "/posts/first.html") """
+
+		self._read()
+		return self._routes.get(full_route, default)
+
+	def find(self, key, value):
+		"""
+		return the pages whose key is value, or includes value if it has several
+		lines. key is a metadata key, or "name", "route" or "mtime"
+		"""
+
+		found = []
+		for page in self.pages:
+			v = _value(page, key)
+			if v == value or (isinstance(v, list) and value in v):
+				found.append(page)
+
+		return found
+
+	def group(self, key):
+		"""
+		return an ordered mapping from each value of key to the pages with that
+		value, in order of first appearance. a page with several lines is listed
+		under each of them
+		"""
+
+		groups = collections.OrderedDict()
+		for page in self.pages:
+			v = _value(page, key)
+			if v == None:
+				continue
+			for item in v if isinstance(v, list) else [v]:
+				groups.setdefault(item, []).append(page)
+
+		return groups
+
+	def sorted(self, key, reverse=False):
+		""" return the pages sorted by key; pages without it come last """
+
+		has_key = [page for page in self.pages if _value(page, key) != None]
+		missing = [page for page in self._pages if _value(page, key) == None]
+
+		return sorted(has_key, key=lambda page: _value(page, key), reverse=reverse) + missing
+
+	def fingerprint(self):
+		""" return a hash of the whole index, which changes when any page's entry does """
+
+		if self._fingerprint == None:
+			data = json.dumps(self._load(), sort_keys=True, default=repr)
+			self._fingerprint = hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+		return self._fingerprint
+
+	def __getstate__(self):
+		# a copy sent to another process takes the scanned pages with it
+		self._load()
+		state = dict(self.__dict__)
+		state["loader"] = None
+		return state
@@ -0,0 +1,378 @@
+#!/usr/bin/env python
+
+# This file is part of Gansa.
+
+# Gansa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Gansa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Gansa.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+publish a built site by uploading only the files that changed since the last
+publish
+
+the hashes of the files published to each target are kept in the project's
+cache folder. the files are compared with them to find the files that were
+added, changed and removed, and only those are uploaded or deleted.
+"""
+
+from __future__ import print_function
+import os, re, gzip, json, shutil, hashlib, tempfile, fnmatch, subprocess, collections
+import six
+
+from gansa.assets import AssetHashes
+from gansa.files import atomic_write, make_folder, replace_file, temp_name
+
+# file extensions of the compressed siblings, and the encodings they hold
+COMPRESSIONS = {"gz": "gzip", "br": "brotli"}
+
+# scp-style targets, e.g. "user@example.com:/var/www"
+SCP_TARGET_RE = re.compile(r"^(?P<host>[^/:]{2,}):(?P<path>.*)$")
+
+# number of files removed by each remote command
+REMOVE_BATCH_SIZE = 500
+
+def compress(src, dst, extension):
+	""" write a gzip (extension "gz") or brotli ("br") compressed copy of src to dst """
+
+	with open(src, "rb") as stream:
+		data = stream.read()
+
+	if extension == "gz":
+		buf = six.BytesIO()
+		# a fixed timestamp keeps the output the same for the same input
+		with gzip.GzipFile(filename="", mode="wb", fileobj=buf, compresslevel=9, mtime=0) as z:
+			z.write(data)
+		data = buf.getvalue()
+	elif extension == "br":
+		try:
+			import brotli
+		except ImportError:
+			raise ImportError("brotli compression requires the brotli package")
+		data = brotli.compress(data)
+	else:
+		raise ValueError("{0} is not a recognized compression".format(extension))
+
+	with atomic_write(dst) as stream:
+		stream.write(data)
+
+class LocalTarget(object):
+	""" publish to a folder on this machine """
+
+	def __init__(self, path):
+		self.path = os.path.abspath(path)
+
+	def upload(self, files):
+		""" copy each (local file name, published name) pair in files """
+
+		for src, name in files:
+			dst = os.path.join(self.path, *name.split("/"))
+			make_folder(os.path.dirname(dst))
+
+			# the file being served is only ever replaced by a complete copy
+			tmp = temp_name(dst)
+			try:
+				shutil.copy2(src, tmp)
+			except BaseException:
+				if os.path.exists(tmp):
+					os.remove(tmp)
+				raise
+			replace_file(tmp, dst)
+
+	def remove(self, names):
+
+		for name in names:
+			dst = os.path.join(self.path, *name.split("/"))
+			try:
+				os.remove(dst)
+			except OSError:
+				continue
+
+			# remove folders left empty
+			folder = os.path.dirname(dst)
+			while folder != self.path and folder.startswith(self.path):
+				try:
+					os.rmdir(folder)
+				except OSError:
+					break
+				folder = os.path.dirname(folder)
+
+class RsyncTarget(object):
+	"""
+	publish to a folder on another machine with rsync over ssh
+
+	host is an ssh destination (e.g. "user@example.com"), and path is the
+	folder on it. removed files are deleted with ssh; the folders they leave
+	empty are kept.
+	"""
+
+	def __init__(self, host, path, port=None, rsync="rsync", ssh="ssh"):
+		self.host = host
+		self.path = path or "."
+		self.rsync = rsync
+		self.ssh = [ssh] + (["-p", str(port)] if port else [])
+
+	def upload(self, files):
+
+		# rsync needs the files under the names they are published as, so they
+		# are linked into a temporary folder first
+		staging = tempfile.mkdtemp(prefix="gansa-publish-")
+
+		try:
+			for src, name in files:
+				link = os.path.join(staging, *name.split("/"))
+				make_folder(os.path.dirname(link))
+				os.symlink(os.path.abspath(src), link)
+
+			process = subprocess.Popen([
+				self.rsync, "--recursive", "--copy-links", "--times", "--files-from=-", "--from0",
+				"--rsh=" + " ".join(six.moves.shlex_quote(arg) for arg in self.ssh),
+				staging + "/", "{0}:{1}/".format(self.host, self.path.rstrip("/"))
+			], stdin=subprocess.PIPE)
+			process.communicate(b"\0".join(name.encode("utf-8") for _, name in files))
+
+			if process.returncode != 0:
+				raise OSError("rsync exited with status {0}".format(process.returncode))
+		finally:
+			shutil.rmtree(staging)
+
+	def remove(self, names):
+
+		names = list(names)
+
+		for i in range(0, len(names), REMOVE_BATCH_SIZE):
+			command = "cd {0} && rm -f -- {1}".format(
+				six.moves.shlex_quote(self.path),
+				" ".join(six.moves.shlex_quote(name) for name in names[i:i + REMOVE_BATCH_SIZE])
+			)
+			subprocess.check_call(self.ssh + [self.host, command])
+
+def _local_target(url):
+	return LocalTarget(six.moves.urllib.parse.urlparse(url).path)
+
+def _rsync_target(url):
+
+	parsed = six.moves.urllib.parse.urlparse(url)
+	host = parsed.hostname
+	if parsed.username:
+		host = parsed.username + "@" + host
+
+	return RsyncTarget(host, parsed.path, port=parsed.port)
+
+# url schemes, and the functions that make targets of them. other kinds of
+# target can be added here; a target has upload(files) and remove(names) methods
+TARGETS = {
+	"file": _local_target,
+	"ssh": _rsync_target,
+	"rsync": _rsync_target
+}
+
+def get_target(url):
+	"""
+	return the target that url points to: a local folder (a path or a file://
+	url), a folder on another machine reached with rsync over ssh
+	("user@host:path" or ssh://user@host:port/path), or a target of any other
+	scheme in TARGETS
+	"""
+
+	if "://" not in url:
+		m = SCP_TARGET_RE.match(url)
+		if m:
+			return RsyncTarget(m.group("host"), m.group("path"))
+		return LocalTarget(url)
+
+	scheme = url.split("://", 1)[0]
+	if scheme not in TARGETS:
+		raise ValueError("{0} is not a recognized publish target".format(url))
+
+	return TARGETS[scheme](url)
+
+def _is_page(name):
+	""" return True if name is a page, or a compressed sibling of one """
+
+	root, extension = os.path.splitext(name)
+	if extension[1:] in COMPRESSIONS:
+		root, extension = os.path.splitext(root)
+
+	return extension in (".html", ".htm")
+
+class Publisher(object):
+	"""
+	publishes the contents of folder to the target at url (see get_target),
+	remembering what was published in cache_folder
+
+	parameters:
+		jobs=4: number of uploads run at the same time
+		compress=(): extensions of the compressed siblings ("gz", "br") to publish
+			along with each file whose name matches one of compress_types. a
+			sibling is only published if it is smaller than the file.
+	"""
+
+	def __init__(self, folder, url, cache_folder, jobs=4, compress=(), compress_types=()):
+
+		for extension in compress:
+			if extension not in COMPRESSIONS:
+				raise ValueError("{0} is not a recognized compression".format(extension))
+
+		self.folder = os.path.abspath(folder)
+		self.url = url
+		self.target = get_target(url)
+		self.cache_folder = cache_folder
+		self.jobs = max(1, jobs)
+		self.compress = list(compress)
+		self.compress_types = list(compress_types)
+		self.stats = collections.Counter()
+
+		key = hashlib.sha1(url.encode("utf-8")).hexdigest()[:16]
+		self.manifest_fname = os.path.join(cache_folder, "{0}.json".format(key))
+		self.compressed_folder = os.path.join(cache_folder, "compressed")
+
+	def _files(self):
+		""" return a mapping from the published name of each file to its local file name and hash """
+
+		hashes = AssetHashes(os.path.join(self.cache_folder, "hashes.json"))
+		files = {}
+
+		for dirpath, dirnames, filenames in os.walk(self.folder):
+			for f in filenames:
+				src = os.path.join(dirpath, f)
+				name = os.path.relpath(src, self.folder).replace(os.sep, "/")
+				digest = hashes.get(src)
+				files[name] = (src, digest)
+
+				if not any(fnmatch.fnmatch(name, p) for p in self.compress_types):
+					continue
+
+				for extension in self.compress:
+					compressed = self._compressed(src, digest, extension)
+					if compressed:
+						files[name + "." + extension] = (compressed, digest + "." + extension)
+
+		hashes.save()
+
+		return files
+
+	def _compressed(self, src, digest, extension):
+		""" return the compressed copy of src, making it if needed, or None if it is not smaller """
+
+		dst = os.path.join(self.compressed_folder, digest + "." + extension)
+
+		if not os.path.exists(dst):
+			compress(src, dst, extension)
+
+		self._compressed_fnames.add(dst)
+
+		if os.path.getsize(dst) >= os.path.getsize(src):
+			return None
+		return dst
+
+	def _load_manifest(self):
+
+		try:
+			with open(self.manifest_fname) as stream:
+				return json.load(stream)["files"]
+		except (IOError, OSError, ValueError, KeyError):
+			return {}
+
+	def _save_manifest(self, published):
+
+		with atomic_write(self.manifest_fname, mode="w") as stream:
+			json.dump({"target": self.url, "files": published}, stream, indent=1, sort_keys=True)
+
+	def plan(self, force=False):
+		"""
+		return the files to upload (as a mapping from published names to local
+		file names and hashes), the names of the files to remove, and the hashes
+		of every file in the folder
+
+		with force, every file is uploaded
+		"""
+
+		self._compressed_fnames = set()
+		files = self._files()
+		published = {} if force else self._load_manifest()
+
+		upload = dict((name, f) for name, f in files.items() if published.get(name) != f[1])
+		remove = sorted(set(published) - set(files))
+
+		return upload, remove, dict((name, f[1]) for name, f in files.items())
+
+	def _upload(self, files):
+
+		if not files:
+			return
+
+		# each job uploads an even share of the files
+		chunks = [files[i::self.jobs] for i in range(self.jobs)]
+		chunks = [chunk for chunk in chunks if chunk]
+
+		if len(chunks) == 1:
+			self.target.upload(chunks[0])
+			return
+
+		from multiprocessing.pool import ThreadPool
+		pool = ThreadPool(len(chunks))
+		try:
+			pool.map(self.target.upload, chunks)
+		finally:
+			pool.close()
+			pool.join()
+
+	def publish(self, dry_run=False, force=False, log=None):
+		"""
+		upload the added and changed files, then remove the files that are gone
+
+		pages are uploaded after the rest of the files, so that the assets they
+		link to are in place first. the record of what was published is only
+		updated if every upload succeeds. log is called with a line for each
+		file that is uploaded or removed.
+
+		returns the stats of the publish
+		"""
+
+		if not os.path.isdir(self.folder):
+			raise OSError("Cannot find folder to publish")
+
+		make_folder(self.cache_folder)
+
+		upload, remove, files = self.plan(force)
+
+		self.stats.clear()
+		self.stats["files uploaded"] = len(upload)
+		self.stats["files removed"] = len(remove)
+		self.stats["files unchanged"] = len(files) - len(upload)
+
+		if log:
+			for name in sorted(upload):
+				log("upload " + name)
+			for name in remove:
+				log("remove " + name)
+
+		if dry_run:
+			return self.stats
+
+		names = sorted(upload)
+		self._upload([(upload[name][0], name) for name in names if not _is_page(name)])
+		self._upload([(upload[name][0], name) for name in names if _is_page(name)])
+
+		if remove:
+			self.target.remove(remove)
+
+		self._save_manifest(files)
+
+		# forget compressed copies of files that are no longer published
+		if os.path.exists(self.compressed_folder):
+			for f in os.listdir(self.compressed_folder):
+				fname = os.path.join(self.compressed_folder, f)
+				if fname not in self._compressed_fnames:
+					os.remove(fname)
+
+		return self.stats
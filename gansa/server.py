@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+
+# This file is part of Gansa.
+
+# Gansa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Gansa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Gansa.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+import os, threading, traceback, collections, shutil, email.utils
+import six
+
+RELOAD_PATH = "/__gansa__/reload"
+
+RELOAD_SCRIPT = """<script>
+new EventSource("{0}").onmessage = function () {{ window.location.reload(); }};
+</script>""".format(RELOAD_PATH)
+
+def _is_temporary(fname):
+	""" return True for the backup and swap files left behind by text editors """
+
+	name = os.path.basename(fname)
+	return name.startswith(".") or name.endswith(("~", ".swp", ".swx", ".tmp"))
+
+class Watcher(object):
+	""" polls a list of files and folders for changes """
+
+	def __init__(self, paths, interval=0.5):
+		self.paths = paths
+		self.interval = interval
+		self.mtimes = self._scan()
+
+	def _scan(self):
+
+		mtimes = {}
+
+		for path in self.paths:
+			if os.path.isdir(path):
+				fnames = (
+					os.path.join(dirpath, f)
+					for dirpath, dirnames, filenames in os.walk(path)
+					for f in filenames
+				)
+			else:
+				fnames = [path]
+
+			for fname in fnames:
+				if _is_temporary(fname):
+					continue
+				try:
+					mtimes[fname] = os.stat(fname).st_mtime
+				except OSError:
+					pass
+
+		return mtimes
+
+	def set_paths(self, paths):
+		""" watch paths instead, starting from their current state """
+
+		if paths != self.paths:
+			self.paths = paths
+			self.mtimes = self._scan()
+
+	def changes(self):
+		""" return the files that were added, modified or removed since the last call """
+
+		mtimes = self._scan()
+		changed = [f for f in set(mtimes) | set(self.mtimes) if mtimes.get(f) != self.mtimes.get(f)]
+		self.mtimes = mtimes
+
+		return sorted(changed)
+
+	def watch(self, callback, stop):
+		""" call callback with the list of changed files until the stop event is set """
+
+		while not stop.wait(self.interval):
+			changed = self.changes()
+			if changed:
+				callback(changed)
+
+class ReloadNotifier(object):
+	""" lets request threads wait until the site has been rebuilt """
+
+	def __init__(self):
+		self.condition = threading.Condition()
+		self.generation = 0
+
+	def notify(self):
+
+		with self.condition:
+			self.generation += 1
+			self.condition.notify_all()
+
+	def wait(self, generation, timeout=None):
+		""" wait until the site is newer than generation, and return the current generation """
+
+		with self.condition:
+			if self.generation == generation:
+				self.condition.wait(timeout)
+			return self.generation
+
+class FileCache(object):
+	""" thread-safe, size-limited cache of the contents of small files """
+
+	def __init__(self, max_size=64 * 1024 * 1024, max_file_size=256 * 1024):
+		self.max_size = max_size
+		self.max_file_size = max_file_size
+		self.size = 0
+		self.files = collections.OrderedDict()
+		self.lock = threading.Lock()
+
+	def get(self, fname, st):
+		"""
+		return the contents of fname, whose current os.stat result is st, or
+		None if the file is too large to be cached
+		"""
+
+		if st.st_size > self.max_file_size:
+			return None
+
+		key = (st.st_mtime, st.st_size)
+
+		with self.lock:
+			entry = self.files.pop(fname, None)
+			if entry != None:
+				self.size -= len(entry[1])
+				if entry[0] != key:
+					entry = None
+
+		if entry == None:
+			with open(fname, "rb") as f:
+				entry = (key, f.read())
+
+		with self.lock:
+			if fname not in self.files:
+				self.files[fname] = entry
+				self.size += len(entry[1])
+
+			while self.size > self.max_size:
+				_, (_, body) = self.files.popitem(last=False)
+				self.size -= len(body)
+
+		return entry[1]
+
+class RequestHandler(six.moves.SimpleHTTPServer.SimpleHTTPRequestHandler):
+	"""
+	serves the current directory over persistent connections
+
+	responses carry ETag and Last-Modified headers, so that browsers can
+	revalidate their copies cheaply. small files are served from memory, and
+	large ones are sent with sendfile where the platform supports it.
+
+	if the handler has a notifier, html pages are served with a script that
+	reloads them whenever the notifier reports that the site was rebuilt
+	"""
+
+	protocol_version = "HTTP/1.1"
+	# headers and bodies are sent separately, and would otherwise wait on delayed acks
+	disable_nagle_algorithm = True
+	notifier = None
+	file_cache = FileCache()
+
+	def do_GET(self):
+		self.send_path()
+
+	def do_HEAD(self):
+		self.send_path(head=True)
+
+	def send_path(self, head=False):
+
+		if self.notifier and self.path.split("?")[0] == RELOAD_PATH:
+			return self.send_reload_events()
+
+		fname = self.translate_path(self.path)
+
+		if os.path.isdir(fname):
+			if not self.path.split("?")[0].endswith("/"):
+				self.send_response(301)
+				self.send_header("Location", self.path.split("?")[0] + "/")
+				self.send_header("Content-Length", "0")
+				self.end_headers()
+				return
+
+			if not os.path.isfile(os.path.join(fname, "index.html")):
+				# directory listings are left to the base class
+				f = six.moves.SimpleHTTPServer.SimpleHTTPRequestHandler.send_head(self)
+				if f:
+					try:
+						if not head:
+							self.copyfile(f, self.wfile)
+					finally:
+						f.close()
+				return
+
+			fname = os.path.join(fname, "index.html")
+
+		try:
+			st = os.stat(fname)
+		except OSError:
+			return self.send_error(404, "File not found")
+
+		etag = '"{0:x}-{1:x}"'.format(int(st.st_mtime * 1000000), st.st_size)
+		last_modified = self.date_time_string(st.st_mtime)
+
+		if self.is_not_modified(etag, st.st_mtime):
+			self.send_response(304)
+			self.send_header("ETag", etag)
+			self.send_header("Last-Modified", last_modified)
+			self.end_headers()
+			return
+
+		body = self.file_cache.get(fname, st)
+
+		if self.notifier and fname.endswith((".html", ".htm")):
+			if body == None:
+				with open(fname, "rb") as f:
+					body = f.read()
+
+			script = RELOAD_SCRIPT.encode("utf-8")
+			i = body.lower().rfind(b"</body>")
+			body = body[:i] + script + body[i:] if i >= 0 else body + script
+
+		self.send_response(200)
+		self.send_header("Content-Type", self.guess_type(fname))
+		self.send_header("Content-Length", str(st.st_size if body == None else len(body)))
+		self.send_header("ETag", etag)
+		self.send_header("Last-Modified", last_modified)
+		self.send_header("Cache-Control", "no-cache")
+		self.end_headers()
+
+		if head:
+			return
+
+		if body != None:
+			self.wfile.write(body)
+		else:
+			with open(fname, "rb") as f:
+				self.send_file(f)
+
+	def is_not_modified(self, etag, mtime):
+
+		if_none_match = self.headers.get("If-None-Match")
+		if if_none_match:
+			return etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+
+		if_modified_since = self.headers.get("If-Modified-Since")
+		if if_modified_since:
+			try:
+				since = email.utils.mktime_tz(email.utils.parsedate_tz(if_modified_since))
+			except (TypeError, ValueError, OverflowError):
+				return False
+			return int(mtime) <= since
+
+		return False
+
+	def send_file(self, f):
+
+		self.wfile.flush()
+
+		sendfile = getattr(self.connection, "sendfile", None)
+		if sendfile:
+			# falls back to a plain copy when os.sendfile cannot be used
+			sendfile(f)
+		else:
+			shutil.copyfileobj(f, self.wfile)
+
+	def send_reload_events(self):
+		""" send a server-sent event every time the site is rebuilt """
+
+		# the event stream has no length, so the connection cannot be reused
+		self.close_connection = True
+
+		self.send_response(200)
+		self.send_header("Content-Type", "text/event-stream")
+		self.send_header("Cache-Control", "no-cache")
+		self.send_header("Connection", "close")
+		self.end_headers()
+
+		generation = self.notifier.generation
+
+		try:
+			while True:
+				current = self.notifier.wait(generation, timeout=15)
+				if current != generation:
+					generation = current
+					self.wfile.write(b"data: reload\n\n")
+				else:
+					# comments keep the connection alive and reveal closed clients
+					self.wfile.write(b": ping\n\n")
+				self.wfile.flush()
+		except (IOError, OSError):
+			return
+
+class ThreadingServer(six.moves.socketserver.ThreadingMixIn, six.moves.socketserver.TCPServer):
+	""" HTTP server that handles each connection in its own thread """
+
+	allow_reuse_address = True
+	daemon_threads = True
+	request_queue_size = 64
+
+def _watched_paths(site, user_settings_file=""):
+	""" return the files and folders that the source of site is read from """
+
+	src = site.environment_src
+	environment = site.settings["environment"]
+
+	paths = [
+		os.path.join(src, environment["pages"]),
+		os.path.join(src, environment["templates"]),
+		os.path.join(src, environment["assets"]),
+		os.path.join(src, environment["views"]),
+		os.path.join(src, "settings.yaml"),
+	] + site._db_fnames()
+
+	if user_settings_file:
+		paths.append(os.path.abspath(user_settings_file))
+	elif environment["user"]:
+		paths.append(os.path.join(src, environment["user"]))
+
+	return paths
+
+def watch_site(site, notifier, stop, out="", user_settings_file="", interval=0.5):
+	""" rebuild the parts of site affected by changes to its source, until stop is set """
+
+	watcher = Watcher(_watched_paths(site, user_settings_file), interval)
+
+	def rebuild(changed):
+		try:
+			if site.rebuild(changed, out=out, user_settings_file=user_settings_file):
+				notifier.notify()
+		except Exception:
+			traceback.print_exc()
+
+		# a change to the settings may move the folders or database files
+		watcher.set_paths(_watched_paths(site, user_settings_file))
+
+	watcher.watch(rebuild, stop)
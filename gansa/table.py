@@ -0,0 +1,680 @@
+#!/usr/bin/env python
+
+# This file is part of Gansa.
+
+# Gansa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Gansa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Gansa.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+import array, ast, bisect, operator, csv, itertools, re
+import six
+
+BOOLS = {"true": True, "false": False}
+
+try:
+	array.array("q")
+	INT_TYPECODE = "q"
+except ValueError:
+	INT_TYPECODE = "l"
+
+OPERATORS = {
+	ast.Eq: operator.eq,
+	ast.NotEq: operator.ne,
+	ast.Lt: operator.lt,
+	ast.LtE: operator.le,
+	ast.Gt: operator.gt,
+	ast.GtE: operator.ge,
+	ast.In: lambda a, b: a in b,
+	ast.NotIn: lambda a, b: a not in b,
+}
+
+# the operator to use when the operands of a comparison are swapped
+SWAPPED_OPERATORS = {
+	ast.Eq: ast.Eq,
+	ast.NotEq: ast.NotEq,
+	ast.Lt: ast.Gt,
+	ast.LtE: ast.GtE,
+	ast.Gt: ast.Lt,
+	ast.GtE: ast.LtE,
+}
+
+# every string that int() or float() accepts starts like this
+_may_be_number = re.compile(r"\s*[-+]?(\d|\.\d|inf|nan)", re.IGNORECASE).match
+_is_int = re.compile(r"\s*[-+]?\d+\s*$").match
+
+def convert_cell(s):
+	""" convert a csv cell to a number or bool if possible """
+
+	if s == None:
+		return None
+
+	# most text cannot be a number, and is cheaper to rule out than to try to convert
+	if not _may_be_number(s):
+		return BOOLS.get(s, s)
+
+	if _is_int(s):
+		return int(s)
+
+	try:
+		return float(s)
+	except ValueError:
+		return BOOLS.get(s, s)
+
+def infer_kind(values):
+	"""
+	return the kind of column a sample of csv cells belongs to: "int", "float",
+	"bool" or "object"
+
+	columns that mix ints and floats are "object" columns, so that each value
+	keeps the type it would have on its own
+	"""
+
+	if not values or None in values:
+		return "object"
+
+	if all(_is_int(v) for v in values):
+		return "int"
+
+	if all(v in BOOLS for v in values):
+		return "bool"
+
+	if not any(_is_int(v) for v in values):
+		try:
+			for v in values:
+				float(v)
+		except ValueError:
+			pass
+		else:
+			return "float"
+
+	return "object"
+
+class TableBuilder(object):
+	"""
+	creates a table from rows of csv cells, a chunk of rows at a time
+
+	the type of each column is inferred from the first chunk, unless it is
+	declared in types (a dict mapping column names or numbers to "int",
+	"float", "bool", "str" or "auto"). each chunk is then converted a whole
+	column at a time. an inferred column that turns out to hold other values
+	falls back to converting each cell on its own, while a declared column
+	raises ValueError.
+	"""
+
+	def __init__(self, names=None, convert=True, types=None, sample_size=100):
+		self.names = names
+		self.convert = convert
+		self.types = types or {}
+		self.sample_size = sample_size
+		self.columns = None
+		self.kinds = None
+		self.declared = None
+		self.lengths = array.array(INT_TYPECODE)
+		self.ragged = False
+		self.size = 0
+
+	def _declared_type(self, i):
+
+		key = self.names[i] if self.names != None else i
+		t = self.types.get(key, "auto")
+
+		if t not in ("auto", "int", "float", "bool", "str"):
+			raise ValueError("{0} is not a recognized column type".format(t))
+		elif t == "auto" and not self.convert:
+			t = "str"
+
+		return t
+
+	def _add_column(self, sample):
+
+		i = len(self.columns)
+		declared = self._declared_type(i)
+
+		if declared == "auto":
+			kind = infer_kind(sample)
+		else:
+			kind = {"str": "object"}.get(declared, declared)
+
+		self.declared.append(declared)
+
+		if self.size:
+			# the column is new to this chunk, so earlier rows are missing a cell
+			self.kinds.append("object")
+			self.columns.append([None] * self.size)
+			self._fall_back(i)
+		else:
+			self.kinds.append(kind)
+			self.columns.append(self._storage(kind))
+
+	def _storage(self, kind):
+
+		if kind == "int":
+			return array.array(INT_TYPECODE)
+		elif kind == "float":
+			return array.array("d")
+		elif kind == "bool":
+			return array.array("b")
+
+		return []
+
+	def _fall_back(self, i):
+		""" store column i as a list of individually converted cells """
+
+		if self.declared[i] not in ("auto", "str"):
+			raise ValueError("column {0} is declared as {1}, but not all of its values are".format(
+				repr(self.names[i] if self.names != None else i), self.declared[i]
+			))
+
+		if self.kinds[i] == "bool":
+			self.columns[i] = [bool(v) for v in self.columns[i]]
+		elif self.kinds[i] != "object":
+			self.columns[i] = list(self.columns[i])
+
+		self.kinds[i] = "object"
+
+	def _convert(self, kind, values, inferred=True):
+		""" convert a chunk of a column, raising ValueError if the values are not all of kind """
+
+		try:
+			if kind == "int":
+				return array.array(INT_TYPECODE, [int(v) for v in values])
+			elif kind == "float":
+				# ints in an inferred float column keep their type, as if converted alone
+				if inferred and any(_is_int(v) for v in values):
+					raise ValueError("int in float column")
+				return array.array("d", [float(v) for v in values])
+			elif kind == "bool":
+				return array.array("b", [BOOLS[v] for v in values])
+		except (TypeError, KeyError, OverflowError):
+			raise ValueError("{0} column has other values".format(kind))
+
+	def add_rows(self, rows):
+
+		if not rows:
+			return
+
+		if self.names != None:
+			width = len(self.names)
+			rows = [row[:width] + [None] * (width - len(row)) if len(row) != width else row for row in rows]
+		else:
+			width = max(len(row) for row in rows)
+			self.lengths.extend([len(row) for row in rows])
+			if any(len(row) != width for row in rows) or (self.columns and width != len(self.columns)):
+				self.ragged = True
+			rows = [row + [None] * (width - len(row)) if len(row) != width else row for row in rows]
+
+		if self.columns == None:
+			self.columns, self.kinds, self.declared = [], [], []
+
+		for i, values in enumerate(zip(*rows)):
+			if i == len(self.columns):
+				self._add_column(values[:self.sample_size])
+
+			if self.declared[i] == "str":
+				self.columns[i].extend(values)
+				continue
+
+			if self.kinds[i] != "object":
+				try:
+					self.columns[i].extend(self._convert(self.kinds[i], values, self.declared[i] == "auto"))
+					continue
+				except ValueError:
+					self._fall_back(i)
+
+			self.columns[i].extend([convert_cell(v) for v in values])
+
+		# columns that earlier chunks had but this one does not
+		for i in six.moves.range(width, len(self.columns)):
+			if self.kinds[i] != "object":
+				self._fall_back(i)
+			self.columns[i].extend([None] * len(rows))
+
+		self.size += len(rows)
+
+	def table(self):
+
+		if self.columns == None:
+			self.columns, self.kinds, self.declared = [], [], []
+			for _ in self.names or []:
+				self._add_column(())
+
+		return Table(
+			self.columns,
+			self.kinds,
+			names=self.names,
+			lengths=self.lengths if self.ragged else None
+		)
+
+def read_csv(stream, header=False, convert=True, types=None, chunk_size=10000):
+	"""
+	load a csv file into a table, reading chunk_size rows at a time
+
+	parameters:
+		header=False: use the first row as column names
+		convert=True: convert cells to numbers and bools
+		types=None: dict mapping columns to declared types (see TableBuilder)
+	"""
+
+	reader = csv.reader(stream)
+	names = next(reader, []) if header else None
+	builder = TableBuilder(names=names, convert=convert, types=types)
+
+	while True:
+		rows = list(itertools.islice(reader, chunk_size))
+		if not rows:
+			break
+		builder.add_rows(rows)
+
+	return builder.table()
+
+def _literal(node):
+	return ast.literal_eval(node)
+
+def _row_key(node):
+	""" return the key of a row[key] expression, or raise ValueError """
+
+	if not isinstance(node, ast.Subscript) or not isinstance(node.value, ast.Name) or node.value.id != "row":
+		raise ValueError("not a row lookup")
+
+	key = node.slice
+	if getattr(ast, "Index", None) and isinstance(key, ast.Index):
+		key = key.value
+
+	return _literal(key)
+
+def compile_condition(expression):
+	"""
+	compile a filter expression into a list of conditions
+
+	expressions that compare row[key] to constants (e.g. 'row["age"] >= 18',
+	'0 < row[2] < 10', 'row["published"]' or any of these joined with 'and')
+	are evaluated one column at a time. any other expression is evaluated
+	row by row, as a lambda of row.
+	"""
+
+	try:
+		return _compile_node(ast.parse(expression.strip(), mode="eval").body)
+	except (ValueError, SyntaxError, TypeError):
+		return [RowCondition(eval("lambda row: " + expression, {}))]
+
+def _compile_node(node):
+
+	if isinstance(node, ast.BoolOp) and isinstance(node.op, ast.And):
+		conditions = []
+		for value in node.values:
+			conditions.extend(_compile_node(value))
+		return conditions
+
+	if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+		return [ColumnCondition(_row_key(node.operand), [(operator.not_, None)])]
+
+	if isinstance(node, ast.Compare):
+		key = None
+		tests = []
+		left = node.left
+
+		for op, right in zip(node.ops, node.comparators):
+			try:
+				k = _row_key(left)
+				value = _literal(right)
+				op_type = type(op)
+			except ValueError:
+				k = _row_key(right)
+				value = _literal(left)
+				if type(op) not in SWAPPED_OPERATORS:
+					raise ValueError("cannot swap operands")
+				op_type = SWAPPED_OPERATORS[type(op)]
+
+			if key != None and k != key:
+				raise ValueError("comparison of more than one column")
+
+			if op_type not in OPERATORS:
+				# e.g. 'is' and 'is not', which are left to the row by row lambda
+				raise ValueError("unsupported column operator")
+
+			key = k
+			tests.append((OPERATORS[op_type], value))
+			left = right
+
+		return [ColumnCondition(key, tests)]
+
+	return [ColumnCondition(_row_key(node), [(operator.truth, None)])]
+
+class RowCondition(object):
+	""" filter condition evaluated on each row """
+
+	def __init__(self, function):
+		self.function = function
+
+	def select(self, table, rowids):
+
+		if rowids == None:
+			rowids = six.moves.range(len(table))
+
+		return [i for i in rowids if self.function(Row(table, i))]
+
+class ColumnCondition(object):
+	""" filter condition evaluated on the values of a single column """
+
+	def __init__(self, key, tests):
+		self.key = key
+		self.tests = tests
+
+	def test(self, v):
+
+		for op, value in self.tests:
+			if op in (operator.truth, operator.not_):
+				if not op(v):
+					return False
+			elif not op(v, value):
+				return False
+
+		return True
+
+	def select(self, table, rowids):
+
+		index = table.indexes.get(self.key)
+		if index:
+			matches = index.select(self.tests)
+			if matches != None:
+				if rowids == None:
+					return sorted(matches)
+				matches = set(matches)
+				return [i for i in rowids if i in matches]
+
+		# bools are stored as ints, which compare the same way
+		column = table.columns[table.column_number(self.key)]
+		test = self.test
+
+		if rowids == None:
+			return [i for i, v in enumerate(column) if test(v)]
+
+		return [i for i in rowids if test(column[i])]
+
+class Index(object):
+	""" sorted index of the values of a column, for equality and range lookups """
+
+	def __init__(self, column):
+
+		try:
+			order = sorted(six.moves.range(len(column)), key=column.__getitem__)
+		except TypeError:
+			raise ValueError("cannot index a column whose values cannot be compared")
+
+		if isinstance(column, array.array):
+			self.values = array.array(column.typecode, [column[i] for i in order])
+		else:
+			self.values = [column[i] for i in order]
+		self.rowids = array.array(INT_TYPECODE, order)
+
+	def select(self, tests):
+		""" return the ids of the rows that pass every test, or None if the index cannot be used """
+
+		lo, hi = 0, len(self.values)
+
+		for op, value in tests:
+			if op == operator.eq:
+				lo = max(lo, bisect.bisect_left(self.values, value))
+				hi = min(hi, bisect.bisect_right(self.values, value))
+			elif op == operator.lt:
+				hi = min(hi, bisect.bisect_left(self.values, value))
+			elif op == operator.le:
+				hi = min(hi, bisect.bisect_right(self.values, value))
+			elif op == operator.gt:
+				lo = max(lo, bisect.bisect_right(self.values, value))
+			elif op == operator.ge:
+				lo = max(lo, bisect.bisect_left(self.values, value))
+			else:
+				return None
+
+		return self.rowids[lo:hi] if lo < hi else []
+
+class Table(object):
+	"""
+	csv table stored one column at a time
+
+	tables behave like read-only lists of rows. rows are looked up by column
+	name if the table has names (i.e. the csv file has a header row, and rows
+	are stored as dicts), or by column number otherwise.
+	"""
+
+	def __init__(self, columns, kinds, names=None, lengths=None):
+		self.columns = columns
+		self.kinds = kinds
+		self.names = names
+		self.keys = dict((name, i) for i, name in enumerate(names)) if names != None else None
+		# number of cells in each row, if the rows are not all the same length
+		self.lengths = lengths
+		self.indexes = {}
+
+	@classmethod
+	def from_rows(cls, rows, names=None, convert=True, types=None):
+		""" create a table from a list of rows, each a list of csv cells """
+
+		builder = TableBuilder(names=names, convert=convert, types=types)
+		builder.add_rows([list(row) for row in rows])
+		return builder.table()
+
+	def __len__(self):
+		return len(self.columns[0]) if self.columns else 0
+
+	def __iter__(self):
+		for i in six.moves.range(len(self)):
+			yield Row(self, i)
+
+	def __getitem__(self, i):
+
+		if isinstance(i, slice):
+			return TableView(self, list(six.moves.range(*i.indices(len(self)))))
+
+		if i < 0:
+			i += len(self)
+		if not 0 <= i < len(self):
+			raise IndexError("table index out of range")
+
+		return Row(self, i)
+
+	def __repr__(self):
+		return "<Table: {0} rows>".format(len(self))
+
+	def column_number(self, key):
+
+		if self.keys != None:
+			return self.keys[key]
+
+		if key < 0:
+			key += len(self.columns)
+		if not 0 <= key < len(self.columns):
+			raise IndexError("row index out of range")
+
+		return key
+
+	def column(self, key):
+		""" return the values of a column """
+
+		i = self.column_number(key)
+		if self.kinds[i] == "bool":
+			return [bool(v) for v in self.columns[i]]
+
+		return self.columns[i]
+
+	def create_index(self, key):
+		self.indexes[key] = Index(self.columns[self.column_number(key)])
+
+	def select(self, conditions=(), order=()):
+		"""
+		return a view of the rows that pass every condition, sorted by order
+
+		parameters:
+			conditions=(): conditions created by compile_condition
+			order=(): list of (key, "ascending" or "descending") pairs
+		"""
+
+		rowids = None
+
+		for condition in conditions:
+			rowids = condition.select(self, rowids)
+
+		if order:
+			if rowids == None:
+				rowids = list(six.moves.range(len(self)))
+			self.sort(rowids, order)
+
+		return TableView(self, rowids)
+
+	def sort(self, rowids, order):
+		""" sort a list of row ids in place """
+
+		columns = [self.columns[self.column_number(k)] for k, _ in order]
+		descending = [d == "descending" for _, d in order]
+		kinds = [self.kinds[self.column_number(k)] for k, _ in order]
+
+		if len(order) == 1:
+			rowids.sort(key=columns[0].__getitem__, reverse=descending[0])
+		elif all(descending) or not any(descending):
+			rowids.sort(key=lambda i: tuple(c[i] for c in columns), reverse=descending[0])
+		elif all(kind != "object" or not d for kind, d in zip(kinds, descending)):
+			# numeric keys can be negated, so a single ascending sort will do
+			signs = [-1 if d else 1 for d in descending]
+			rowids.sort(key=lambda i: tuple(c[i] * s if s < 0 else c[i] for c, s in zip(columns, signs)))
+		else:
+			for column, d in reversed(list(zip(columns, descending))):
+				rowids.sort(key=column.__getitem__, reverse=d)
+
+class TableView(object):
+	""" read-only view of a subset of the rows of a table """
+
+	def __init__(self, table, rowids=None):
+		self.table = table
+		self.rowids = rowids
+
+	def __len__(self):
+		return len(self.table) if self.rowids == None else len(self.rowids)
+
+	def __iter__(self):
+
+		if self.rowids == None:
+			for row in self.table:
+				yield row
+		else:
+			for i in self.rowids:
+				yield Row(self.table, i)
+
+	def __getitem__(self, i):
+
+		if self.rowids == None:
+			return self.table[i]
+		elif isinstance(i, slice):
+			return TableView(self.table, self.rowids[i])
+
+		return Row(self.table, self.rowids[i])
+
+	def __bool__(self):
+		return len(self) > 0
+
+	__nonzero__ = __bool__
+
+	def __eq__(self, other):
+		return list(self) == list(other)
+
+	def __ne__(self, other):
+		return not self == other
+
+	def __repr__(self):
+		return "<TableView: {0} rows>".format(len(self))
+
+class Row(object):
+	""" view of a single row of a table """
+
+	# underscored, so that templates reach columns named "table" or "i"
+	# (jinja tries attributes before items)
+	__slots__ = ("_table", "_i")
+
+	def __init__(self, table, i):
+		self._table = table
+		self._i = i
+
+	def __len__(self):
+
+		if self._table.names != None:
+			return len(self._table.names)
+		elif self._table.lengths != None:
+			return self._table.lengths[self._i]
+
+		return len(self._table.columns)
+
+	def __getitem__(self, key):
+
+		table = self._table
+
+		if table.names == None:
+			if isinstance(key, slice):
+				return [self[k] for k in six.moves.range(*key.indices(len(self)))]
+			if key < 0:
+				key += len(self)
+			if not 0 <= key < len(self):
+				raise IndexError("row index out of range")
+
+		i = table.column_number(key)
+		v = table.columns[i][self._i]
+
+		return bool(v) if table.kinds[i] == "bool" else v
+
+	def __iter__(self):
+
+		if self._table.names != None:
+			return iter(self._table.names)
+
+		return (self[k] for k in six.moves.range(len(self)))
+
+	def __contains__(self, item):
+
+		if self._table.names != None:
+			return item in self._table.keys
+
+		return item in list(self)
+
+	def get(self, key, default=None):
+
+		try:
+			return self[key]
+		except (KeyError, IndexError):
+			return default
+
+	def keys(self):
+		return list(self._table.names) if self._table.names != None else list(six.moves.range(len(self)))
+
+	def values(self):
+		return [self[k] for k in self.keys()]
+
+	def items(self):
+		return [(k, self[k]) for k in self.keys()]
+
+	def materialize(self):
+		""" return a copy of the row as a dict or list """
+		return dict(self.items()) if self._table.names != None else self.values()
+
+	def __eq__(self, other):
+
+		if isinstance(other, Row):
+			other = other.materialize()
+
+		return self.materialize() == other
+
+	def __ne__(self, other):
+		return not self == other
+
+	__hash__ = None
+
+	def __repr__(self):
+		return repr(self.materialize())
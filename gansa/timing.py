@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+# This file is part of Gansa.
+
+# Gansa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Gansa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Gansa.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+import os, time, json, threading, collections
+
+# phases that are reported for each view, in the order they happen
+VIEW_PHASES = ["query", "markdown", "template", "context processor", "render"]
+
+class _NullPhase(object):
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		return False
+
+class NullProfiler(object):
+	""" profiler that records nothing; used when a build is not being profiled """
+
+	enabled = False
+
+	def __init__(self):
+		self.events = []
+		self._phase = _NullPhase()
+
+	def phase(self, name, route=None):
+		return self._phase
+
+class _Phase(object):
+
+	def __init__(self, profiler, name, route):
+		self.profiler = profiler
+		self.name = name
+		self.route = route
+
+	def __enter__(self):
+		self.start = time.time()
+		return self
+
+	def __exit__(self, *args):
+		self.profiler.events.append(
+			(self.name, self.route, self.start, time.time() - self.start, os.getpid(), threading.current_thread().ident)
+		)
+		return False
+
+class Profiler(NullProfiler):
+	"""
+	records how long each phase of a build takes
+
+	each event is a (name, route, start, duration, pid, thread id) tuple. route
+	is the full route of the view the phase belongs to, if any.
+	"""
+
+	enabled = True
+
+	def phase(self, name, route=None):
+		""" return a context manager that records the time spent inside it """
+		return _Phase(self, name, route)
+
+	def summary(self, count=10):
+		""" return a table of the slowest phases and views """
+
+		phases = collections.defaultdict(lambda: [0.0, 0])
+		views = collections.defaultdict(lambda: collections.defaultdict(float))
+
+		for name, route, start, duration, pid, tid in self.events:
+			if name != "view":
+				phases[name][0] += duration
+				phases[name][1] += 1
+			if route != None:
+				views[route][name] += duration
+
+		lines = ["{0:<20} {1:>10} {2:>8}".format("phase", "seconds", "calls")]
+		for name, (total, calls) in sorted(phases.items(), key=lambda item: -item[1][0]):
+			lines.append("{0:<20} {1:>10.3f} {2:>8}".format(name, total, calls))
+
+		if views:
+			lines.append("")
+			lines.append("{0:<40} {1:>8}".format("slowest views", "total") + "".join(
+				" {0:>8}".format(name[:8]) for name in VIEW_PHASES
+			))
+			for route, times in sorted(views.items(), key=lambda item: -item[1]["view"])[:count]:
+				lines.append("{0:<40} {1:>8.3f}".format(route[-40:], times["view"]) + "".join(
+					" {0:>8.3f}".format(times[name]) for name in VIEW_PHASES
+				))
+
+		return "\n".join(lines)
+
+	def write_trace(self, fname):
+		""" write the events to fname in the chrome trace event format """
+
+		events = []
+		for name, route, start, duration, pid, tid in self.events:
+			event = {
+				"name": name,
+				"cat": "gansa",
+				"ph": "X",
+				"ts": int(start * 1000000),
+				"dur": int(duration * 1000000),
+				"pid": pid,
+				"tid": tid,
+			}
+			if route != None:
+				event["args"] = {"route": route}
+				if name == "view":
+					event["name"] = route
+			events.append(event)
+
+		with open(fname, "w") as stream:
+			json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, stream)